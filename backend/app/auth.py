@@ -1,18 +1,32 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .config import get_settings
-from .database import get_db
+from .database import get_async_db
 from . import models, schemas
+from .cache import Principal, principal_cache, token_cache
 
 settings = get_settings()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with another cost than BCRYPT_ROUNDS are reported as needing an update
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 security = HTTPBearer()
 
+# bcrypt takes 100-300 ms of CPU per call: it runs on its own few threads so
+# a burst of logins can't occupy the threadpool serving scans
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+_login_semaphore = asyncio.Semaphore(settings.LOGIN_MAX_CONCURRENCY)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -22,6 +36,41 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def hash_password(password: str) -> str:
+    """get_password_hash on the password executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """Check a password on the password executor; also returns a new hash
+    when the stored one was made with another work factor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
+
+@asynccontextmanager
+async def login_slot():
+    """
+    Caps logins/registrations in flight (LOGIN_MAX_CONCURRENCY). Requests
+    over the cap wait up to LOGIN_WAIT_SECONDS, then get a 503.
+    """
+    try:
+        await asyncio.wait_for(_login_semaphore.acquire(), settings.LOGIN_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        yield
+    finally:
+        _login_semaphore.release()
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -34,30 +83,45 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 
 def verify_token(token: str):
-    """Verify JWT token and return payload"""
+    """Verify JWT token and return payload. Verified tokens are cached until
+    they expire (see cache.TokenCache)"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise JWTError("Invalid token payload")
-        return payload
     except JWTError as e:
         raise JWTError(f"Token validation failed: {str(e)}")
+    token_cache.remember(token, payload)
+    return payload
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalars().first()
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash is not None:
+        # BCRYPT_ROUNDS changed since this hash was made
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> models.User:
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    """
+    Principal of the bearer token. Users are cached by username, so only
+    the first request of a user (or one after a change) queries the table.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -65,16 +129,19 @@ async def get_current_user(
     )
     
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        username: str = verify_token(credentials.credentials)["sub"]
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
-        raise credentials_exception
+    principal = principal_cache.get(username)
+    if principal is None:
+        result = await db.execute(select(models.User).where(models.User.username == username))
+        user = result.scalars().first()
+        if user is None:
+            raise credentials_exception
+        principal = principal_cache.remember(user)
     
-    return user
+    if not principal.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    
+    return principal
@@ -0,0 +1,227 @@
+import abc
+import asyncio
+import logging
+import os
+import secrets
+import socket
+from typing import Callable, Optional, Union
+from . import events
+from .events import SSEEvent
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class Broker(abc.ABC):
+    """
+    Carries published events to the SSE manager of every worker/instance.
+    publish() delivers to the local manager right away and hands a copy to
+    the transport (_send); copies coming back from the transport with our
+    own origin are ignored, so each subscriber gets an event exactly once.
+    """
+
+    def __init__(self):
+        self.origin = secrets.token_hex(8)
+        # Set by SSEManager: local delivery and "events may have been lost"
+        self.deliver: Optional[Callable[[int, SSEEvent], None]] = None
+        self.on_gap: Optional[Callable[[str], None]] = None
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, session_id: int, event: SSEEvent):
+        self.deliver(session_id, event)
+        try:
+            await self._send(self._encode(session_id, event))
+        except Exception as e:
+            # Remote instances miss this event, their clients resync on reconnect
+            logger.warning("SSE broker publish failed: %s", e)
+
+    @abc.abstractmethod
+    async def _send(self, message: bytes):
+        """Hand an encoded event to the other workers/instances"""
+
+    def _encode(self, session_id: int, event: SSEEvent) -> bytes:
+        return events.dumps({
+            "origin": self.origin,
+            "session_id": session_id,
+            "user_id": event.user_id,
+            "mode": event.mode,
+            "categories": list(event.categories) if event.categories is not None else None,
+            "event": event.event,
+            "payload": event.payload,
+        })
+
+    def _receive(self, message: Union[bytes, str]):
+        try:
+            data = events.loads(message)
+        except ValueError:
+            logger.warning("SSE broker dropped a malformed message")
+            return
+        if data["origin"] != self.origin:
+            categories = data["categories"]
+            event = SSEEvent(data["event"], data["payload"], frozenset(categories) if categories is not None else None)
+            event.scope(data["session_id"], data["user_id"], data["mode"])
+            self.deliver(data["session_id"], event)
+
+
+class InProcessBroker(Broker):
+    """Single process: nothing to forward"""
+
+    async def publish(self, session_id: int, event: SSEEvent):
+        # Local delivery only, events aren't even encoded
+        self.deliver(session_id, event)
+
+    async def _send(self, message: bytes):
+        pass
+
+
+class PostgresBroker(Broker):
+    """
+    PostgreSQL LISTEN/NOTIFY on a dedicated connection (Cloud SQL). NOTIFY
+    payloads are limited to 8000 bytes, larger events (big scan batches)
+    reach other instances as a resync event.
+    """
+
+    MAX_PAYLOAD = 7900
+    RECONNECT_DELAY = 5.0
+
+    def __init__(self, channel: str):
+        super().__init__()
+        self.channel = channel
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._lost: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._lost = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        from .database import connect_listener
+
+        connected_before = False
+        while True:
+            try:
+                self._conn = await connect_listener()
+                self._conn.add_termination_listener(lambda conn: self._lost.set())
+                await self._conn.add_listener(self.channel, self._on_notify)
+                logger.info("SSE broker listening on PostgreSQL channel %s", self.channel)
+                if connected_before:
+                    # Notifications sent while we were away are gone
+                    self.on_gap("broker")
+                connected_before = True
+
+                await self._lost.wait()
+                logger.warning("SSE broker connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("SSE broker connection failed: %s", e)
+            self._conn = None
+            self._lost.clear()
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        self._receive(payload)
+
+    async def _send(self, message: bytes):
+        if self._conn is None:
+            return
+        if len(message) > self.MAX_PAYLOAD:
+            data = events.loads(message)
+            resync = events.resync("broker").scope(data["session_id"], data["user_id"], data["mode"])
+            message = self._encode(data["session_id"], resync)
+        async with self._lock:
+            # One asyncpg connection runs one statement at a time
+            await self._conn.execute("SELECT pg_notify($1, $2)", self.channel, message.decode())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+class UnixSocketBroker(Broker):
+    """
+    Local stand-in for several workers on one machine (uvicorn --workers,
+    tests): each process binds a Unix datagram socket in a shared directory
+    and sends every event to the other sockets found there.
+    """
+
+    MAX_DATAGRAM = 200_000
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self.path: Optional[str] = None
+        self._sock: Optional[socket.socket] = None
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}-{self.origin}.sock")
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.MAX_DATAGRAM)
+        self._sock.bind(self.path)
+        self._sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self._sock.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        while True:
+            try:
+                message = self._sock.recv(self.MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            self._receive(message)
+
+    async def _send(self, message: bytes):
+        if self._sock is None:
+            return
+        if len(message) > self.MAX_DATAGRAM:
+            data = events.loads(message)
+            resync = events.resync("broker").scope(data["session_id"], data["user_id"], data["mode"])
+            message = self._encode(data["session_id"], resync)
+
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if peer == self.path or not name.endswith(".sock"):
+                continue
+            try:
+                self._sock.sendto(message, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker gone without cleaning up
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                logger.warning("SSE broker dropped an event for busy worker %s", name)
+
+    async def stop(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+            os.unlink(self.path)
+
+
+def create_broker() -> Broker:
+    """Broker selected by SSE_BROKER (memory | postgres | unix)"""
+    if settings.SSE_BROKER == "postgres":
+        return PostgresBroker(settings.SSE_BROKER_CHANNEL)
+    if settings.SSE_BROKER == "unix":
+        return UnixSocketBroker(settings.SSE_BROKER_SOCKET_DIR)
+    if settings.SSE_BROKER != "memory":
+        raise ValueError(f"Unknown SSE_BROKER: {settings.SSE_BROKER}")
+    return InProcessBroker()
@@ -0,0 +1,343 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+from . import models
+from .config import get_settings
+
+settings = get_settings()
+
+
+class CatalogEntry(NamedTuple):
+    id: int
+    sap_article: str
+    category: models.CategoryEnum
+    part_number: str
+    description: str
+    created_at: datetime
+    updated_at: datetime
+
+
+class ArticleCatalog:
+    """
+    Versioned in-memory index of the article table keyed by sap_article.
+    Articles are unique per (sap_article, category), so each key holds every
+    matching row. The index is rebuilt as a whole and swapped in one
+    assignment, readers never see a half-built catalog.
+    """
+
+    def __init__(self, max_age_seconds: int):
+        self._index: Optional[dict[str, tuple[CatalogEntry, ...]]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.max_age_seconds = max_age_seconds
+        self.version = 0
+
+    def load(self, db: Session) -> dict[str, tuple[CatalogEntry, ...]]:
+        """Rebuild the index from the database and swap it in"""
+        rows = db.query(
+            models.Article.id,
+            models.Article.sap_article,
+            models.Article.category,
+            models.Article.part_number,
+            models.Article.description,
+            models.Article.created_at,
+            models.Article.updated_at
+        ).order_by(models.Article.id).all()
+
+        grouped: dict[str, list[CatalogEntry]] = {}
+        for row in rows:
+            grouped.setdefault(row.sap_article, []).append(CatalogEntry(*row))
+        index = {sap_article: tuple(entries) for sap_article, entries in grouped.items()}
+
+        with self._lock:
+            self._index = index
+            self._loaded_at = time.monotonic()
+            self.version += 1
+        return index
+
+    def invalidate(self):
+        """Drop the index, it is rebuilt on next use"""
+        with self._lock:
+            self._index = None
+
+    def _is_stale(self, index) -> bool:
+        # Other instances may have replaced the catalog, refresh periodically
+        return index is None or time.monotonic() - self._loaded_at > self.max_age_seconds
+
+    def _current(self, db: Session) -> dict[str, tuple[CatalogEntry, ...]]:
+        index = self._index
+        if self._is_stale(index):
+            index = self.load(db)
+        return index
+
+    def lookup(self, db: Session, sap_article: str) -> tuple[CatalogEntry, ...]:
+        """All catalog rows (one per category) for a SAP article"""
+        return self._current(db).get(sap_article, ())
+
+    def first(self, db: Session, sap_article: str) -> Optional[CatalogEntry]:
+        """First catalog row for a SAP article, used for category auto-detection"""
+        entries = self.lookup(db, sap_article)
+        return entries[0] if entries else None
+
+    async def afirst(self, db: AsyncSession, sap_article: str) -> Optional[CatalogEntry]:
+        """first() for async handlers"""
+        index = self._index
+        if self._is_stale(index):
+            index = await db.run_sync(self.load)
+        entries = index.get(sap_article, ())
+        return entries[0] if entries else None
+
+
+# Global catalog instance
+article_catalog = ArticleCatalog(settings.ARTICLE_CATALOG_MAX_AGE_SECONDS)
+
+
+class BOMItemCache:
+    """
+    LRU cache of BOM contents: bom_id -> {sap_article: expected quantity}.
+    BOMs are immutable after upload, so entries are loaded once in a single
+    query and only leave the cache on delete or when the total number of
+    cached items goes over max_items.
+    """
+
+    def __init__(self, max_items: int):
+        self._boms: OrderedDict[int, dict[str, float]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.max_items = max_items
+
+    def get(self, db: Session, bom_id: int) -> dict[str, float]:
+        """Expected quantities of a BOM keyed by SAP article"""
+        with self._lock:
+            items = self._boms.get(bom_id)
+            if items is not None:
+                self._boms.move_to_end(bom_id)
+                return items
+
+        rows = db.query(
+            models.BOMItem.sap_article,
+            models.BOMItem.quantity
+        ).filter(
+            models.BOMItem.bom_id == bom_id
+        ).order_by(models.BOMItem.id).all()
+
+        items = {}
+        for sap_article, quantity in rows:
+            # First row wins for repeated articles, like the old .first() lookups
+            items.setdefault(sap_article, quantity)
+
+        with self._lock:
+            if bom_id not in self._boms:
+                self._boms[bom_id] = items
+                self._size += len(items)
+                # Keep at least the BOM just loaded, even if it alone is over the bound
+                while self._size > self.max_items and len(self._boms) > 1:
+                    _, evicted = self._boms.popitem(last=False)
+                    self._size -= len(evicted)
+        return items
+
+    def expected_quantity(self, db: Session, bom_id: int, sap_article: str) -> Optional[float]:
+        """Expected quantity of an article in a BOM, None if it is not part of it"""
+        return self.get(db, bom_id).get(sap_article)
+
+    async def aget(self, db: AsyncSession, bom_id: int) -> dict[str, float]:
+        """get() for async handlers, only a cache miss touches the database"""
+        with self._lock:
+            items = self._boms.get(bom_id)
+            if items is not None:
+                self._boms.move_to_end(bom_id)
+                return items
+        return await db.run_sync(self.get, bom_id)
+
+    async def aexpected_quantity(self, db: AsyncSession, bom_id: int, sap_article: str) -> Optional[float]:
+        """expected_quantity() for async handlers"""
+        return (await self.aget(db, bom_id)).get(sap_article)
+
+    def evict(self, bom_id: int):
+        """Drop a BOM from the cache (deleted)"""
+        with self._lock:
+            items = self._boms.pop(bom_id, None)
+            if items is not None:
+                self._size -= len(items)
+
+
+# Global BOM cache instance
+bom_cache = BOMItemCache(settings.BOM_CACHE_MAX_ITEMS)
+
+
+class RecentScanIds:
+    """
+    Bounded window of recently accepted client scan IDs -> record id.
+    Retries normally arrive within seconds, so they are answered from here;
+    older duplicates are still rejected by the unique index on
+    scan_records.client_scan_id.
+    """
+
+    def __init__(self, max_size: int):
+        self._ids: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+
+    def get(self, client_scan_id: str) -> Optional[int]:
+        with self._lock:
+            return self._ids.get(client_scan_id)
+
+    def remember(self, client_scan_id: str, record_id: int):
+        with self._lock:
+            self._ids[client_scan_id] = record_id
+            self._ids.move_to_end(client_scan_id)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+
+# Global recent scan ID window
+recent_scan_ids = RecentScanIds(settings.SCAN_ID_WINDOW_SIZE)
+
+
+class Principal(NamedTuple):
+    """Authenticated user as handlers see it, immutable and detached from any session"""
+    id: int
+    username: str
+    is_active: bool
+
+
+class PrincipalCache:
+    """
+    TTL + LRU map of JWT subject (username) -> Principal, so authenticated
+    requests don't query the users table. Entries are dropped when a User
+    row is updated or deleted through the ORM (see the listeners below);
+    the TTL bounds staleness for changes made elsewhere (other instances,
+    raw SQL).
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self._entries: OrderedDict[str, tuple[Principal, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            principal, cached_at = entry
+            if time.monotonic() - cached_at > self.ttl_seconds:
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return principal
+
+    def remember(self, user: models.User) -> Principal:
+        principal = Principal(user.id, user.username, bool(user.is_active))
+        with self._lock:
+            self._entries[principal.username] = (principal, time.monotonic())
+            self._entries.move_to_end(principal.username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, username: Optional[str] = None):
+        """Drop one user, or every user when the username isn't known"""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+
+# Global principal cache, used by auth.get_current_user
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_MAX_SIZE, settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+class TokenCache:
+    """
+    LRU map of SHA-256(token) -> verified JWT claims. Tokens live for days
+    and are sent with every request, so after the first call a token costs
+    a lookup instead of a signature check and a JSON parse. An entry is
+    used until the token's exp, like jwt.decode would; the token itself is
+    not kept. Callers must not modify the returned claims.
+    """
+
+    def __init__(self, max_size: int):
+        self._entries: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def remember(self, token: str, claims: dict):
+        """Keep the claims of a token that passed verification"""
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            # Without exp a token never expires, keep verifying it
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (claims, float(expires_at))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+# Global verified token cache, used by auth.verify_token
+token_cache = TokenCache(settings.TOKEN_CACHE_MAX_SIZE)
+
+
+def _changed_usernames(target: models.User) -> set[Optional[str]]:
+    # Old and new name when the username itself changed; read from the
+    # attribute history so nothing is loaded during the flush
+    history = inspect(target).attrs.username.history
+    return {name for name in (*history.unchanged, *history.deleted, *history.added) if name} or {None}
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _user_changed(mapper, connection, target: models.User):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_usernames", set()).update(_changed_usernames(target))
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _invalidate_changed_principals(session: Session):
+    # Once the transaction is over: invalidating at flush time would let a
+    # concurrent request cache the old row again before the commit
+    for username in session.info.pop("changed_usernames", ()):
+        principal_cache.invalidate(username)
@@ -22,6 +22,42 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "dev-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 10080  # 7 days
+    BCRYPT_ROUNDS: int = 12  # work factor, existing hashes are upgraded on login
+    PASSWORD_HASH_WORKERS: int = 2  # threads hashing/verifying passwords, apart from the request threadpool
+    LOGIN_MAX_CONCURRENCY: int = 8  # logins/registrations in flight, the rest wait
+    LOGIN_WAIT_SECONDS: float = 10.0  # then get 503 with Retry-After
+    
+    # In-memory caches
+    ARTICLE_CATALOG_MAX_AGE_SECONDS: int = 300  # picks up uploads made on other instances
+    BOM_CACHE_MAX_ITEMS: int = 50000  # total BOM items kept across cached BOMs
+    SCAN_ID_WINDOW_SIZE: int = 10000  # recent client scan IDs kept for retry detection
+    PRINCIPAL_CACHE_MAX_SIZE: int = 1024  # authenticated users kept without a users query
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60  # bounds staleness of changes made outside this process
+    TOKEN_CACHE_MAX_SIZE: int = 4096  # verified JWTs kept until they expire
+    
+    # Group commit for concurrent scan inserts (opt-in)
+    SCAN_GROUP_COMMIT: bool = False
+    SCAN_GROUP_COMMIT_WINDOW_MS: int = 5
+    SCAN_GROUP_COMMIT_MAX_SIZE: int = 50
+    
+    # SSE subscriber queues
+    SSE_QUEUE_SIZE: int = 256  # events buffered per connection
+    SSE_OVERFLOW_POLICY: str = "drop_oldest"  # drop_oldest | resync | disconnect
+    SSE_REPLAY_SIZE: int = 500  # events kept per topic for Last-Event-ID replay
+    SSE_REPLAY_MAX_TOPICS: int = 1000  # least recently used topic histories are dropped
+    SSE_COALESCE_MS: int = 0  # scans of a session within this window go out as one scan_batch (0 = off)
+    SSE_COALESCE_MAX: int = 50  # a window holding this many scans is flushed early
+    SSE_HEARTBEAT_SECONDS: float = 15.0  # ping idle streams, close those that don't send it
+    
+    # SSE fan-out across workers/instances
+    SSE_BROKER: str = "memory"  # memory | postgres (LISTEN/NOTIFY) | unix (local workers, tests)
+    SSE_BROKER_CHANNEL: str = "sse_events"
+    SSE_BROKER_SOCKET_DIR: str = "/tmp/inventory-scanner-sse"
+    
+    # Logging
+    LOG_LEVEL: str = "INFO"  # WARNING in production
+    LOG_JSON: bool = False  # one JSON object per line (Cloud Logging)
+    LOG_SCAN_SAMPLE_RATE: float = 1.0  # fraction of per-scan debug lines kept
     
     class Config:
         env_file = ".env"
@@ -1,5 +1,7 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base  # mantiene compat 1.4
 from .config import get_settings
@@ -42,6 +44,38 @@ if DB_DIALECT.startswith("postgresql"):
         pool_recycle=1800,
     )
 
+    # Async path (asyncpg). The async connector must be created inside the
+    # running event loop, so it is built on first connection.
+    from google.cloud.sql.connector import create_async_connector
+
+    async_connector = None
+
+    async def getconn_async():
+        global async_connector
+        if async_connector is None:
+            async_connector = await create_async_connector()
+        return await async_connector.connect_async(
+            DB_INSTANCE,
+            "asyncpg",
+            user=DB_USER,
+            password=DB_PASS,
+            db=DB_NAME,
+            ip_type=IPTypes.PUBLIC,
+        )
+
+    async_engine = create_async_engine(
+        "postgresql+asyncpg://",
+        async_creator=getconn_async,
+        pool_pre_ping=True,
+        pool_size=5,
+        max_overflow=2,
+        pool_recycle=1800,
+    )
+
+    async def connect_listener():
+        """Dedicated asyncpg connection outside the pool (LISTEN/NOTIFY)"""
+        return await getconn_async()
+
 else:
     # Fallback local (tu comportamiento actual con SQLite).
     # Usa settings.DATABASE_URL (ej. "sqlite:///./local.db")
@@ -51,7 +85,21 @@ else:
 
     engine = create_engine(settings.DATABASE_URL, connect_args=connect_args)
 
+    # Same database through an async driver (aiosqlite / asyncpg)
+    async_url = make_url(settings.DATABASE_URL)
+    async_drivers = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+    async_url = async_url.set(drivername=async_drivers.get(async_url.get_backend_name(), async_url.drivername))
+    async_engine = create_async_engine(async_url)
+
+    async def connect_listener():
+        """Dedicated asyncpg connection outside the pool (LISTEN/NOTIFY)"""
+        import asyncpg
+        dsn = async_url.set(drivername="postgresql").render_as_string(hide_password=False)
+        return await asyncpg.connect(dsn)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay loaded after commit: async handlers can't lazy-load expired attributes
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -61,3 +109,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """AsyncSession dependency for async def handlers (doesn't block the event loop)"""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,212 @@
+"""
+SSE event shapes, defined once.
+
+An event is encoded a single time into a ready-to-send SSE frame; the same
+object is then put on every subscriber queue, so fan-out to one more panel
+doesn't encode anything.
+"""
+import json
+from typing import FrozenSet, Iterable, Optional
+from . import models
+
+try:
+    import orjson
+
+    def dumps(payload: dict) -> bytes:
+        return orjson.dumps(payload)
+
+    loads = orjson.loads
+except ImportError:
+    # orjson is optional, fall back to the stdlib encoder
+    def dumps(payload: dict) -> bytes:
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+# Line separator used by sse_starlette
+SEP = b"\r\n"
+
+
+class SSEEvent:
+    """
+    Pre-framed SSE event, the payload is encoded once. Besides the payload
+    it carries what subscription filters look at: the session it belongs
+    to, its owner and mode (set on publish) and the detected categories of
+    its records (None when it isn't about records).
+    """
+    __slots__ = ("event", "payload", "data", "id", "seq", "frame", "_body",
+                 "categories", "session_id", "user_id", "mode", "_projections")
+
+    def __init__(self, event: str, payload: dict, categories: Optional[FrozenSet[Optional[str]]] = None):
+        self.event = event
+        self.payload = payload
+        self.categories = categories
+        self.session_id: Optional[int] = None
+        self.user_id: Optional[int] = None
+        self.mode: Optional[str] = None
+        self._projections: Optional[dict] = None
+        self.id: Optional[str] = None
+        self.seq = 0
+        self.data = dumps(payload)  # also sent as is over the scanner WebSocket
+        # JSON has no raw newlines, so the payload always fits in one data line
+        self._body = b"event: " + event.encode() + SEP + b"data: " + self.data + SEP + SEP
+        self.frame = self._body
+
+    def stamp(self, event_id: str, seq: int) -> "SSEEvent":
+        """Assign the replay ID (sent as the SSE id: field) once, before fan-out"""
+        self.id = event_id
+        self.seq = seq
+        self.frame = b"id: " + event_id.encode() + SEP + self._body
+        return self
+
+    def scope(self, session_id: int, user_id: Optional[int], mode: Optional[str]) -> "SSEEvent":
+        self.session_id = session_id
+        self.user_id = user_id
+        self.mode = mode
+        return self
+
+    def project(self, categories: Optional[FrozenSet[str]], fields: Optional[FrozenSet[str]]) -> "SSEEvent":
+        """
+        Copy for filtered subscribers: only the records of the given
+        categories (scan_batch) and only the given fields of each record.
+        Encoded once per distinct projection, stamped with the same ID.
+        """
+        if self._projections is None:
+            self._projections = {}
+        key = (categories, fields)
+        projected = self._projections.get(key)
+        if projected is None:
+            payload = dict(self.payload)
+            if categories is not None and "records" in payload:
+                payload["records"] = [
+                    record for record in payload["records"]
+                    if record["detected_category"] in categories
+                ]
+                payload["articles"] = _article_deltas(payload["records"])
+            if fields is not None:
+                if "record" in payload:
+                    payload["record"] = _project(payload["record"], fields)
+                if "records" in payload:
+                    payload["records"] = [_project(record, fields) for record in payload["records"]]
+            projected = SSEEvent(self.event, payload, self.categories)
+            projected.scope(self.session_id, self.user_id, self.mode)
+            if self.id is not None:
+                projected.stamp(self.id, self.seq)
+            self._projections[key] = projected
+        return projected
+
+    def __repr__(self):
+        return f"SSEEvent({self.event!r})"
+
+
+def _project(record: dict, fields: FrozenSet[str]) -> dict:
+    return {key: value for key, value in record.items() if key in fields}
+
+
+def _category(record: models.ScanRecord) -> Optional[str]:
+    return record.detected_category.value if record.detected_category else None
+
+
+def record_payload(record: models.ScanRecord) -> dict:
+    """Scan record as sent in scan and scan_batch events"""
+    return {
+        "id": record.id,
+        "sap_article": record.sap_article,
+        "part_number": record.part_number,
+        "description": record.description,
+        "po_number": record.po_number,
+        "quantity": record.quantity,
+        "scanned_at": record.scanned_at.isoformat(),
+        "manual_entry": record.manual_entry,
+        "expected_quantity": record.expected_quantity,
+        "status": record.status.value if record.status else None,
+        "detected_category": record.detected_category.value if record.detected_category else None
+    }
+
+
+def scan(record: models.ScanRecord) -> SSEEvent:
+    return SSEEvent("scan", {
+        "type": "scan",
+        "session_id": record.session_id,
+        "record": record_payload(record)
+    }, frozenset({_category(record)}))
+
+
+def _article_deltas(records: list[dict]) -> dict:
+    # Net change per article, so a client can update its totals without summing
+    articles = {}
+    for record in records:
+        delta = articles.setdefault(record["sap_article"], {"scans": 0, "quantity": 0.0})
+        delta["scans"] += 1
+        delta["quantity"] += record["quantity"]
+    return articles
+
+
+def _scan_batch(session_id: int, records: list[dict]) -> SSEEvent:
+    return SSEEvent("scan_batch", {
+        "type": "scan_batch",
+        "session_id": session_id,
+        "records": records,
+        "articles": _article_deltas(records)
+    }, frozenset(record["detected_category"] for record in records))
+
+
+def scan_batch(session_id: int, records: Iterable[models.ScanRecord]) -> SSEEvent:
+    return _scan_batch(session_id, [record_payload(record) for record in records])
+
+
+def coalesce_scans(session_id: int, scans: list[SSEEvent]) -> SSEEvent:
+    """Several scan events of a session merged into one scan_batch"""
+    return _scan_batch(session_id, [event.payload["record"] for event in scans])
+
+
+def record_updated(record: models.ScanRecord) -> SSEEvent:
+    return SSEEvent("record_updated", {
+        "type": "record_updated",
+        "session_id": record.session_id,
+        "record": {
+            "id": record.id,
+            "sap_article": record.sap_article,
+            "quantity": record.quantity,
+            "status": record.status.value if record.status else None,
+            "detected_category": _category(record)
+        }
+    }, frozenset({_category(record)}))
+
+
+def record_deleted(record: models.ScanRecord) -> SSEEvent:
+    return SSEEvent("record_deleted", {
+        "type": "record_deleted",
+        "session_id": record.session_id,
+        "record_id": record.id
+    }, frozenset({_category(record)}))
+
+
+def session_deleted(session_id: int) -> SSEEvent:
+    return SSEEvent("session_deleted", {
+        "type": "session_deleted",
+        "session_id": session_id
+    })
+
+
+def aggregate(session_aggregate: dict) -> SSEEvent:
+    """Versioned session counters after a change (see totals.session_aggregate)"""
+    categories = None
+    if "articles" in session_aggregate:
+        categories = frozenset(article["detected_category"] for article in session_aggregate["articles"])
+    return SSEEvent("aggregate", {
+        "type": "aggregate",
+        **session_aggregate
+    }, categories)
+
+
+def resync(reason: str) -> SSEEvent:
+    """Events were lost for this client, it must reload its state"""
+    return SSEEvent("resync", {
+        "type": "resync",
+        "reason": reason
+    })
+
+
+# Keep-alive, encoded once for all connections
+PING = SSEEvent("ping", {"type": "ping"})
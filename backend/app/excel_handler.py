@@ -1,7 +1,160 @@
+import logging
+import posixpath
+import zipfile
 from openpyxl import load_workbook
-from typing import List, Dict
+from openpyxl.reader.strings import read_string_table
+from openpyxl.styles.stylesheet import Stylesheet
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.utils.datetime import MAC_EPOCH, WINDOWS_EPOCH, from_excel, from_ISO8601
+from openpyxl.xml.constants import PKG_REL_NS, REL_NS, SHEET_MAIN_NS
+from openpyxl.xml.functions import fromstring, iterparse
+from typing import Dict, Iterator, List, Tuple
 from io import BytesIO
 
+logger = logging.getLogger(__name__)
+
+ROW_TAG = f"{{{SHEET_MAIN_NS}}}row"
+CELL_TAG = f"{{{SHEET_MAIN_NS}}}c"
+VALUE_TAG = f"{{{SHEET_MAIN_NS}}}v"
+INLINE_STRING_TAG = f"{{{SHEET_MAIN_NS}}}is"
+TEXT_TAG = f"{{{SHEET_MAIN_NS}}}t"
+RUN_TAG = f"{{{SHEET_MAIN_NS}}}r"
+SHEET_DATA_TAG = f"{{{SHEET_MAIN_NS}}}sheetData"
+
+
+def _xml_bool(value) -> bool:
+    # Same reading of boolean attributes as openpyxl
+    return value is not None and value not in ("false", "f", "0", "")
+
+
+def _text_content(node) -> str:
+    # Text.from_tree(node).content without building the objects: the plain
+    # <t> followed by the <t> of each rich text run, phonetic runs (<rPh>)
+    # left out
+    plain = None
+    runs = []
+    for child in node:
+        if child.tag == TEXT_TAG:
+            plain = child.text
+        elif child.tag == RUN_TAG:
+            text = child.findtext(TEXT_TAG)
+            if text:
+                runs.append(text)
+    return (plain or "") + "".join(runs)
+
+
+def _relationships(archive: zipfile.ZipFile, part: str) -> Dict[str, Tuple[str, str]]:
+    """Relationships of a package part: id -> (type, target path in the zip)"""
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, "_rels", f"{name}.rels")
+    if rels_path not in archive.NameToInfo:
+        return {}
+    relationships = {}
+    for rel in fromstring(archive.read(rels_path)).iter(f"{{{PKG_REL_NS}}}Relationship"):
+        target = rel.get("Target")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        relationships[rel.get("Id")] = (rel.get("Type"), target)
+    return relationships
+
+
+def _iter_sheet_rows(file_content: bytes) -> Iterator[Tuple[int, bool, Dict[int, object]]]:
+    """
+    Stream the active sheet of an .xlsx as (row number, hidden, {column:
+    value}), parsing the sheet XML straight from the zip with iterparse.
+    Only rows present in the file are yielded and each one is discarded
+    once read, so memory doesn't grow with the sheet. Values are read like
+    openpyxl's data_only mode (cached formula results, int/float, dates by
+    number format). Values inside merged ranges are not blanked, Excel
+    doesn't store any there.
+    """
+    with zipfile.ZipFile(BytesIO(file_content)) as archive:
+        workbook_part = next(
+            target for rel_type, target in _relationships(archive, "").values()
+            if rel_type.endswith("/officeDocument")
+        )
+        workbook = fromstring(archive.read(workbook_part))
+        workbook_rels = _relationships(archive, workbook_part)
+
+        properties = workbook.find(f"{{{SHEET_MAIN_NS}}}workbookPr")
+        epoch = MAC_EPOCH if properties is not None and _xml_bool(properties.get("date1904")) else WINDOWS_EPOCH
+
+        active = 0
+        for view in workbook.iter(f"{{{SHEET_MAIN_NS}}}workbookView"):
+            if view.get("activeTab") is not None:
+                active = int(view.get("activeTab"))
+                break
+        sheets = [
+            workbook_rels[sheet.get(f"{{{REL_NS}}}id")]
+            for sheet in workbook.iter(f"{{{SHEET_MAIN_NS}}}sheet")
+        ]
+        if active >= len(sheets) or not sheets[active][0].endswith("/worksheet"):
+            raise ValueError("The active sheet of the workbook is not a worksheet")
+        sheet_path = sheets[active][1]
+
+        shared_strings = []
+        date_formats = timedelta_formats = frozenset()
+        for rel_type, target in workbook_rels.values():
+            if rel_type.endswith("/sharedStrings") and target in archive.NameToInfo:
+                with archive.open(target) as source:
+                    shared_strings = read_string_table(source)
+            elif rel_type.endswith("/styles") and target in archive.NameToInfo:
+                stylesheet = Stylesheet.from_tree(fromstring(archive.read(target)))
+                date_formats = stylesheet.date_formats
+                timedelta_formats = stylesheet.timedelta_formats
+
+        def cell_value(cell):
+            data_type = cell.get("t", "n")
+            if data_type == "inlineStr":
+                child = cell.find(INLINE_STRING_TAG)
+                return _text_content(child) if child is not None else None
+
+            value = cell.findtext(VALUE_TAG) or None
+            if value is None:
+                return None
+            if data_type == "n":
+                value = float(value) if "." in value or "E" in value or "e" in value else int(value)
+                style_id = int(cell.get("s", 0))
+                if style_id in date_formats:
+                    try:
+                        value = from_excel(value, epoch, timedelta=style_id in timedelta_formats)
+                    except (OverflowError, ValueError):
+                        value = "#VALUE!"
+            elif data_type == "s":
+                value = shared_strings[int(value)]
+            elif data_type == "b":
+                value = bool(int(value))
+            elif data_type == "d":
+                value = from_ISO8601(value)
+            # "str" (formula result) and "e" (error) stay as text
+            return value
+
+        with archive.open(sheet_path) as source:
+            sheet_data = None
+            row_idx = 0
+            for event, element in iterparse(source, events=("start", "end")):
+                if event == "start":
+                    if element.tag == SHEET_DATA_TAG:
+                        sheet_data = element
+                    continue
+                if element.tag == ROW_TAG:
+                    row_idx = int(float(element.get("r"))) if element.get("r") else row_idx + 1
+                    values = {}
+                    col_idx = 0
+                    for cell in element.iterfind(CELL_TAG):
+                        coordinate = cell.get("r")
+                        col_idx = coordinate_to_tuple(coordinate)[1] if coordinate else col_idx + 1
+                        values[col_idx] = cell_value(cell)
+                    yield row_idx, _xml_bool(element.get("hidden")), values
+                    element.clear()
+                    if sheet_data is not None:
+                        sheet_data.remove(element)
+                elif element.tag == SHEET_DATA_TAG:
+                    # Nothing after the cells is needed (merges, formatting...)
+                    break
+
 
 def parse_articles_excel(file_content: bytes) -> List[Dict]:
     """
@@ -21,7 +174,7 @@ def parse_articles_excel(file_content: bytes) -> List[Dict]:
             headers[header_name] = idx
     
     # Debug: print found headers
-    print(f"Found headers: {list(headers.keys())}")
+    logger.debug("Found headers: %s", list(headers.keys()))
     
     # Required columns with flexible matching
     required_mapping = {
@@ -72,26 +225,34 @@ def parse_bom_excel(file_content: bytes, target_category: str = None) -> List[Di
     Parse BOM Excel file.
     Expected columns: SAP Article, Part Number, Description, Quantity
     Only reads VISIBLE rows (skips hidden rows)
-    """
-    # Read Excel WITHOUT read_only to access row dimensions
-    workbook = load_workbook(BytesIO(file_content), read_only=False, data_only=True)
-    sheet = workbook.active
     
+    The sheet is streamed (see _iter_sheet_rows) instead of loading the
+    whole workbook just to read row_dimensions[...].hidden.
+    """
     items = []
     headers = {}
     header_row_index = None
     
-    # Debug: Show all rows content
-    print(f"BOM file has {sheet.max_row} rows. Searching for headers...")
+    # Extended list of possible column names
+    sap_variants = ['sap article', 'sap_article', 'saparticle', 'article', 'sap', 'item', 'item number', 'item no', 'material', 'stock no', 'stock number']
+    pn_variants = ['part number', 'part_number', 'partnumber', 'pn', 'part no', 'part#', 'mfg part', 'manufacturer part']
+    desc_variants = ['description', 'desc', 'item description', 'product description', 'product', 'name', 'item name']
+    qty_variants = ['quantity', 'qty', 'cantidad', 'amount', 'count', 'qnty', 'required qty', 'req qty']
+    cat_variants = ['category', 'categoria', 'cat', 'type', 'item type', 'product type']
+    
+    rows = _iter_sheet_rows(file_content)
+    logger.debug("Searching for BOM headers...")
     
     # Find header row (search first 20 rows for row with expected columns)
-    for row_idx in range(1, min(21, sheet.max_row + 1)):
+    for row_idx, _, values in rows:
+        if row_idx > 20:
+            break
         temp_headers = {}
         row_values = []
         
-        for col_idx, cell in enumerate(sheet[row_idx], start=1):
-            if cell.value:
-                header_name = str(cell.value).strip().lower()
+        for col_idx, value in sorted(values.items()):
+            if value:
+                header_name = str(value).strip().lower()
                 # Remove special characters and extra spaces
                 header_name = header_name.replace('\n', ' ').replace('\r', ' ')
                 header_name = ' '.join(header_name.split())
@@ -100,14 +261,7 @@ def parse_bom_excel(file_content: bytes, target_category: str = None) -> List[Di
         
         # Debug: show what's in this row
         if row_values:
-            print(f"Row {row_idx}: {row_values}")
-        
-        # Extended list of possible column names
-        sap_variants = ['sap article', 'sap_article', 'saparticle', 'article', 'sap', 'item', 'item number', 'item no', 'material', 'stock no', 'stock number']
-        pn_variants = ['part number', 'part_number', 'partnumber', 'pn', 'part no', 'part#', 'mfg part', 'manufacturer part']
-        desc_variants = ['description', 'desc', 'item description', 'product description', 'product', 'name', 'item name']
-        qty_variants = ['quantity', 'qty', 'cantidad', 'amount', 'count', 'qnty', 'required qty', 'req qty']
-        cat_variants = ['category', 'categoria', 'cat', 'type', 'item type', 'product type']
+            logger.debug("Row %d: %s", row_idx, row_values)
         
         # Check if this row has the required columns
         has_sap = any(variant in temp_headers for variant in sap_variants)
@@ -121,7 +275,7 @@ def parse_bom_excel(file_content: bytes, target_category: str = None) -> List[Di
         if matches >= 3 and len(temp_headers) >= 3:  # Found header row
             headers = temp_headers
             header_row_index = row_idx
-            print(f"✅ BOM headers found in row {row_idx}: {list(headers.keys())}")
+            logger.debug("BOM headers found in row %d: %s", row_idx, list(headers.keys()))
             break
     
     if not headers:
@@ -157,27 +311,24 @@ def parse_bom_excel(file_content: bytes, target_category: str = None) -> List[Di
     for variant in cat_variants:
         if variant in headers:
             category_col_idx = headers[variant]
-            print(f"✅ Found category column: {variant} at index {category_col_idx}")
+            logger.debug("Found category column: %s at index %d", variant, category_col_idx)
             break
     
-    # Parse data rows (start after header row) - ONLY visible rows
+    # Parse data rows (the rest of the stream, after the header row) - ONLY visible rows
     skipped_hidden = 0
     skipped_by_category = 0
     
-    for row_idx in range(header_row_index + 1, sheet.max_row + 1):
-        # Check if row is hidden (skip hidden rows from Walmart filters)
-        if sheet.row_dimensions[row_idx].hidden:
-            skipped_hidden += 1
+    for row_idx, hidden, row in rows:
+        if row_idx <= header_row_index:
             continue
         
-        # Get row values
-        row = [sheet.cell(row=row_idx, column=col_idx).value for col_idx in range(1, sheet.max_column + 1)]
-        
-        if not row:
+        # Check if row is hidden (skip hidden rows from Walmart filters)
+        if hidden:
+            skipped_hidden += 1
             continue
         
-        # Get cell values safely
-        sap_val = row[standard_headers['sap article'] - 1] if len(row) >= standard_headers['sap article'] else None
+        # Get cell values safely (cells missing from the file are empty)
+        sap_val = row.get(standard_headers['sap article'])
         
         # Skip empty rows (no SAP article)
         if not sap_val or str(sap_val).strip() == '':
@@ -185,7 +336,7 @@ def parse_bom_excel(file_content: bytes, target_category: str = None) -> List[Di
         
         # Check category if column exists and target_category is specified
         if category_col_idx and target_category:
-            row_category = row[category_col_idx - 1] if len(row) >= category_col_idx else None
+            row_category = row.get(category_col_idx)
             if row_category:
                 row_category_clean = str(row_category).strip().upper()
                 target_category_clean = target_category.upper()
@@ -201,9 +352,9 @@ def parse_bom_excel(file_content: bytes, target_category: str = None) -> List[Di
                     continue
             
         try:
-            pn_val = row[standard_headers['part number'] - 1] if len(row) >= standard_headers['part number'] else ''
-            desc_val = row[standard_headers['description'] - 1] if len(row) >= standard_headers['description'] else ''
-            qty_val = row[standard_headers['quantity'] - 1] if len(row) >= standard_headers['quantity'] else 1
+            pn_val = row.get(standard_headers['part number'])
+            desc_val = row.get(standard_headers['description'])
+            qty_val = row.get(standard_headers['quantity'])
             
             item = {
                 'sap_article': str(sap_val).strip(),
@@ -214,12 +365,12 @@ def parse_bom_excel(file_content: bytes, target_category: str = None) -> List[Di
             items.append(item)
         except (ValueError, TypeError, IndexError) as e:
             # Skip rows with invalid data
-            print(f"Skipping invalid BOM row: {e}")
+            logger.warning("Skipping invalid BOM row: %s", e)
             continue
     
     if skipped_hidden > 0:
-        print(f"🔒 Skipped {skipped_hidden} hidden rows (filtered by Walmart)")
+        logger.info("Skipped %d hidden rows (filtered by Walmart)", skipped_hidden)
     if skipped_by_category > 0:
-        print(f"⚠️  Skipped {skipped_by_category} visible items from other categories")
-    print(f"✅ Parsed {len(items)} VISIBLE BOM items" + (f" for category '{target_category}'" if target_category else ""))
+        logger.info("Skipped %d visible items from other categories", skipped_by_category)
+    logger.info("Parsed %d VISIBLE BOM items%s", len(items), f" for category '{target_category}'" if target_category else "")
     return items
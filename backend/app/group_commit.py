@@ -0,0 +1,103 @@
+import asyncio
+from typing import Optional
+from . import models, totals, events
+from .config import get_settings
+from .database import AsyncSessionLocal
+from .sse import sse_manager
+
+settings = get_settings()
+
+
+class GroupCommitWriter:
+    """
+    Opt-in group commit for scan inserts. Records submitted within a short
+    window (or until max_size is reached) are written in one transaction and
+    each waiting request gets its own record back. If the shared transaction
+    fails, the records are retried one by one so a single bad insert (e.g. a
+    duplicate client_scan_id) only fails its own request.
+    """
+
+    def __init__(self, window_ms: int, max_size: int):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._pending: list[tuple[models.ScanRecord, models.ScanSession, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, record: models.ScanRecord, session: models.ScanSession) -> models.ScanRecord:
+        """Queue a new record of a (validated) session and wait until its
+        transaction commits"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((record, session, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._commit(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _commit(self, batch: list[tuple[models.ScanRecord, models.ScanSession, asyncio.Future]]):
+        try:
+            async with AsyncSessionLocal() as db:
+                records = [record for record, _, _ in batch]
+                db.add_all(records)
+                await totals.add_records(db, records)
+                aggregates = [
+                    await totals.session_aggregate(db, session_id, articles)
+                    for session_id, articles in totals.changed_articles(records).items()
+                ]
+                await db.commit()
+        except Exception:
+            await self._commit_each(batch)
+            return
+
+        sessions = {}
+        for record, session, future in batch:
+            sessions[session.id] = session
+            if not future.done():
+                future.set_result(record)
+        for aggregate in aggregates:
+            await sse_manager.publish(sessions[aggregate["session_id"]], events.aggregate(aggregate))
+
+    async def _commit_each(self, batch: list[tuple[models.ScanRecord, models.ScanSession, asyncio.Future]]):
+        for record, session, future in batch:
+            # The failed flush may have assigned a primary key
+            record.id = None
+            try:
+                async with AsyncSessionLocal() as db:
+                    db.add(record)
+                    await totals.add_records(db, [record])
+                    aggregate = await totals.session_aggregate(
+                        db, record.session_id, [(record.sap_article, record.detected_category)]
+                    )
+                    await db.commit()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(record)
+                await sse_manager.publish(session, events.aggregate(aggregate))
+
+    async def drain(self):
+        """Commit whatever is pending (shutdown)"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# Global writer, used by create_scan_record when SCAN_GROUP_COMMIT is enabled
+scan_writer = GroupCommitWriter(settings.SCAN_GROUP_COMMIT_WINDOW_MS, settings.SCAN_GROUP_COMMIT_MAX_SIZE)
@@ -0,0 +1,154 @@
+"""
+Scan ingestion shared by the HTTP endpoint and the scanner WebSocket.
+
+Errors are raised as HTTPException; the WebSocket turns them into a
+negative ack with the same status code and detail.
+"""
+import logging
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, totals, events
+from .sse import sse_manager
+from .cache import Principal, article_catalog, bom_cache, recent_scan_ids
+from .config import get_settings
+from .group_commit import scan_writer
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def original_scan(original: Optional[models.ScanRecord], session_id: int) -> Optional[models.ScanRecord]:
+    """Validate the original record of a retried submission"""
+    if original is not None and original.session_id != session_id:
+        raise HTTPException(status_code=409, detail="client_scan_id already used in another session")
+    return original
+
+
+async def _recent_scan(db: AsyncSession, client_scan_id: str, session_id: int) -> Optional[models.ScanRecord]:
+    """Original record of a retry seen in the recent scan ID window"""
+    record_id = recent_scan_ids.get(client_scan_id)
+    if record_id is None:
+        return None
+    return original_scan(await db.get(models.ScanRecord, record_id), session_id)
+
+
+async def create_scan(
+    db: AsyncSession,
+    current_user: Principal,
+    record_data: schemas.ScanRecordCreate
+) -> models.ScanRecord:
+    """
+    Validate, store and broadcast one scan of a session owned by
+    current_user. A retried client_scan_id returns the original record.
+    """
+    logger.debug(
+        "Received scan: %s x%s, session %s, user %s",
+        record_data.sap_article, record_data.quantity, record_data.session_id, current_user.username,
+        extra={"sampled": True}
+    )
+    
+    # Validate session
+    result = await db.execute(select(models.ScanSession).where(
+        models.ScanSession.id == record_data.session_id,
+        models.ScanSession.user_id == current_user.id
+    ))
+    session = result.scalars().first()
+    
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if not session.is_active:
+        raise HTTPException(status_code=400, detail="Session is not active")
+    
+    # Retried submission: return the original record without re-processing it
+    client_scan_id = str(record_data.client_scan_id) if record_data.client_scan_id else None
+    if client_scan_id:
+        original = await _recent_scan(db, client_scan_id, session.id)
+        if original:
+            return original
+    
+    # Look up article in the catalog index
+    article = await article_catalog.afirst(db, record_data.sap_article)
+
+    # Auto-detect category from article database
+    detected_cat = None
+    if article:
+        detected_cat = article.category
+    elif record_data.detected_category:
+        # Use manually provided category (for articles not in DB)
+        detected_cat = record_data.detected_category
+    else:
+        # Fallback to session category
+        detected_cat = session.category
+
+    logger.debug(
+        "Category detected for %s: %s", record_data.sap_article,
+        detected_cat.value if detected_cat else None, extra={"sampled": True}
+    )
+
+    # Create scan record
+    db_record = models.ScanRecord(
+        session_id=record_data.session_id,
+        sap_article=record_data.sap_article,
+        part_number=article.part_number if article else None,
+        description=article.description if article else None,
+        detected_category=detected_cat,  # ⭐ NUEVO
+        po_number=record_data.po_number,
+        quantity=record_data.quantity,
+        manual_entry=record_data.manual_entry,
+        client_scan_id=client_scan_id
+    )
+    
+    # If in BOM mode, calculate comparison
+    if session.mode == models.ModeEnum.BOM and session.bom_id:
+        # Get expected quantity from the BOM
+        expected_qty = await bom_cache.aexpected_quantity(db, session.bom_id, record_data.sap_article)
+        
+        if expected_qty is not None:
+            # Status is compared with the scanned total when the record is written
+            db_record.expected_quantity = expected_qty
+        else:
+            # Article not in BOM
+            db_record.status = models.StatusEnum.OVER
+    
+    try:
+        if settings.SCAN_GROUP_COMMIT:
+            # Give the pooled connection back before waiting: the writer
+            # needs one from the same pool to commit the group. close()
+            # expunges without expiring, so session stays readable
+            await db.close()
+            await scan_writer.submit(db_record, session)
+        else:
+            db.add(db_record)
+            await totals.add_records(db, [db_record])
+            aggregate = await totals.session_aggregate(db, session.id, [(db_record.sap_article, detected_cat)])
+            await db.commit()
+    except IntegrityError:
+        # Retry that fell out of the recent window, the unique index caught it
+        await db.rollback()
+        if not client_scan_id:
+            raise
+        result = await db.execute(select(models.ScanRecord).where(
+            models.ScanRecord.client_scan_id == client_scan_id
+        ))
+        # rollback() expired the session object, use the validated ID from the request
+        original = original_scan(result.scalars().first(), record_data.session_id)
+        if original is None:
+            raise
+        recent_scan_ids.remember(client_scan_id, original.id)
+        return original
+    
+    if client_scan_id:
+        recent_scan_ids.remember(client_scan_id, db_record.id)
+    
+    # Broadcast SSE event
+    event = events.scan(db_record)
+    await sse_manager.publish(session, event)  # Session subscribers and panel
+    if not settings.SCAN_GROUP_COMMIT:
+        # The group commit writer publishes the aggregate of its transaction
+        await sse_manager.publish(session, events.aggregate(aggregate))
+    
+    return db_record
@@ -1,6 +1,10 @@
+import logging
 from sqlalchemy.orm import Session
-from . import models, auth
+from . import models, auth, migrations
 from .database import SessionLocal, engine, Base
+from .cache import article_catalog
+
+logger = logging.getLogger(__name__)
 
 
 def init_dev_user(db: Session):
@@ -19,21 +23,23 @@ def init_dev_user(db: Session):
         db.add(dev_user)
         db.commit()
         db.refresh(dev_user)
-        print("✅ Created dev user: username='admin', password='admin123'")
+        logger.info("Created dev user: username='admin', password='admin123'")
         return dev_user
     else:
-        print("ℹ️  Dev user 'admin' already exists")
+        logger.info("Dev user 'admin' already exists")
         return existing_user
 
 
 def init_database():
     """Initialize database and create dev user"""
-    # Create all tables
+    # Create all tables, then bring existing databases up to date
     Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
     
-    # Create dev user
+    # Create dev user and warm the article catalog
     db = SessionLocal()
     try:
         init_dev_user(db)
+        article_catalog.load(db)
     finally:
         db.close()
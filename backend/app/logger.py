@@ -0,0 +1,81 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+from .config import get_settings
+
+settings = get_settings()
+
+# Parent logger of every module in the app package (logging.getLogger(__name__))
+APP_LOGGER = __name__.rpartition(".")[0]
+
+# LogRecord attributes that are not user supplied extras
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sampled"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, extra={...} fields are included as keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records logged with extra={"sampled": True}"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False) and self.rate < 1.0:
+            return random.random() < self.rate
+        return True
+
+
+def setup_logging():
+    """
+    Route the app loggers through a queue so handlers never block the event
+    loop: records are enqueued by the caller and written to stdout by a
+    background listener thread. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.LOG_JSON:
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SCAN_SAMPLE_RATE))
+
+    app_logger = logging.getLogger(APP_LOGGER)
+    app_logger.setLevel(settings.LOG_LEVEL.upper())
+    app_logger.addHandler(queue_handler)
+    app_logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
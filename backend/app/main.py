@@ -1,16 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .database import engine, Base
-from .routers import auth_router, articles_router, bom_router, scan_router, sse_router, reports_router
+from .routers import auth_router, articles_router, bom_router, scan_router, sse_router, ws_router, reports_router
 from .init_db import init_database
+from . import auth
+from .logger import setup_logging
+from .sse import sse_manager
+from .group_commit import scan_writer
+
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables and dev user at startup, not on import: hashing
+    # the dev password costs a full bcrypt round
+    init_database()
+    await sse_manager.start()
+    yield
+    # Commit scans still waiting in the group commit window before exiting
+    await scan_writer.drain()
+    await sse_manager.stop()
+    auth.password_executor.shutdown(wait=False)
 
-# Create database tables and dev user
-init_database()
 
 app = FastAPI(
     title="Inventory Scanner Pro API",
     description="Backend API for real-time inventory scanning and BOM verification",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -39,6 +58,7 @@ app.include_router(articles_router.router)
 app.include_router(bom_router.router)
 app.include_router(scan_router.router)
 app.include_router(sse_router.router)
+app.include_router(ws_router.router)
 app.include_router(reports_router.router)
 
 @app.get("/")
@@ -0,0 +1,186 @@
+"""
+Versioned schema migrations (SQLite and PostgreSQL).
+
+Every migration inspects the live schema before changing it, so a database
+created from scratch by create_all() is simply stamped as up to date.
+Applied versions are recorded in the schema_migrations table.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, NamedTuple
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from . import models, totals
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+# Arbitrary key for pg_advisory_lock, serializes instances starting at the same time
+MIGRATION_LOCK_ID = 72173001
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def _columns(conn: Connection, table: str) -> dict:
+    return {column["name"]: column for column in inspect(conn).get_columns(table)}
+
+
+def _add_column(conn: Connection, table: str, column: Column):
+    """ALTER TABLE ADD COLUMN using the model's column type for this dialect"""
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type}"))
+
+
+def _create_indexes(conn: Connection, table: Table, names=None):
+    for index in table.indexes:
+        if names is None or index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def add_detected_category(conn: Connection):
+    if "detected_category" not in _columns(conn, "scan_records"):
+        _add_column(conn, "scan_records", models.ScanRecord.__table__.c.detected_category)
+
+
+def make_session_category_nullable(conn: Connection):
+    if not _columns(conn, "scan_sessions")["category"]["nullable"]:
+        if conn.dialect.name == "sqlite":
+            # SQLite doesn't support ALTER COLUMN, the table is rebuilt
+            conn.execute(text("""
+                CREATE TABLE scan_sessions_new (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    mode VARCHAR(50) NOT NULL,
+                    category VARCHAR(50),
+                    bom_id INTEGER,
+                    started_at TIMESTAMP NOT NULL,
+                    ended_at TIMESTAMP,
+                    is_active BOOLEAN NOT NULL DEFAULT 1,
+                    FOREIGN KEY(user_id) REFERENCES users(id),
+                    FOREIGN KEY(bom_id) REFERENCES boms(id)
+                )
+            """))
+            conn.execute(text("""
+                INSERT INTO scan_sessions_new (id, user_id, mode, category, bom_id, started_at, ended_at, is_active)
+                SELECT id, user_id, mode, category, bom_id, started_at, ended_at, is_active FROM scan_sessions
+            """))
+            conn.execute(text("DROP TABLE scan_sessions"))
+            conn.execute(text("ALTER TABLE scan_sessions_new RENAME TO scan_sessions"))
+            _create_indexes(conn, models.ScanSession.__table__, {"ix_scan_sessions_id"})
+        else:
+            conn.execute(text("ALTER TABLE scan_sessions ALTER COLUMN category DROP NOT NULL"))
+
+    conn.execute(text("UPDATE scan_sessions SET category = NULL WHERE mode = 'INVENTORY'"))
+
+
+def add_client_scan_id(conn: Connection):
+    if "client_scan_id" not in _columns(conn, "scan_records"):
+        _add_column(conn, "scan_records", models.ScanRecord.__table__.c.client_scan_id)
+    _create_indexes(conn, models.ScanRecord.__table__, {"ix_scan_records_client_scan_id"})
+
+
+def backfill_session_article_totals(conn: Connection):
+    models.SessionArticleTotal.__table__.create(conn, checkfirst=True)
+    has_totals = conn.execute(select(models.SessionArticleTotal.id).limit(1)).first()
+    has_records = conn.execute(select(models.ScanRecord.id).limit(1)).first()
+    if not has_totals and has_records:
+        with Session(bind=conn, join_transaction_mode="create_savepoint") as db:
+            rebuilt = totals.rebuild(db)
+        logger.info("Rebuilt %d session article totals", rebuilt)
+
+
+def add_hot_path_indexes(conn: Connection):
+    _create_indexes(conn, models.ScanRecord.__table__, {
+        "ix_scan_records_session_article",
+        "ix_scan_records_session_status",
+    })
+    _create_indexes(conn, models.BOMItem.__table__, {"ix_bom_items_bom_article"})
+    _create_indexes(conn, models.ScanSession.__table__, {"ix_scan_sessions_user_active_started"})
+
+
+def add_session_totals_version(conn: Connection):
+    if "totals_version" not in _columns(conn, "scan_sessions"):
+        conn.execute(text("ALTER TABLE scan_sessions ADD COLUMN totals_version INTEGER NOT NULL DEFAULT 0"))
+
+
+def add_totals_status_scans(conn: Connection):
+    columns = _columns(conn, "session_article_totals")
+    added = False
+    for column in totals.STATUS_SCANS.values():
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE session_article_totals ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+            added = True
+    has_totals = conn.execute(select(models.SessionArticleTotal.id).limit(1)).first()
+    if added and has_totals:
+        with Session(bind=conn, join_transaction_mode="create_savepoint") as db:
+            rebuilt = totals.rebuild(db)
+        logger.info("Rebuilt %d session article totals", rebuilt)
+
+
+# Append only, never renumber
+MIGRATIONS = [
+    Migration(1, "add scan_records.detected_category", add_detected_category),
+    Migration(2, "make scan_sessions.category nullable", make_session_category_nullable),
+    Migration(3, "add scan_records.client_scan_id", add_client_scan_id),
+    Migration(4, "backfill session_article_totals", backfill_session_article_totals),
+    Migration(5, "add hot path composite indexes", add_hot_path_indexes),
+    Migration(6, "add scan_sessions.totals_version", add_session_totals_version),
+    Migration(7, "add session_article_totals per-status scan counts", add_totals_status_scans),
+]
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    metadata.create_all(conn)
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade(engine: Engine) -> list[Migration]:
+    """Apply pending migrations in order, each one in its own transaction"""
+    applied = []
+    with engine.connect() as conn:
+        is_postgres = conn.dialect.name == "postgresql"
+        if is_postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            conn.commit()
+        try:
+            with conn.begin():
+                done = applied_versions(conn)
+
+            for migration in MIGRATIONS:
+                if migration.version in done:
+                    continue
+                logger.info("Migration %04d: %s", migration.version, migration.name)
+                with conn.begin():
+                    migration.upgrade(conn)
+                    conn.execute(schema_migrations.insert().values(
+                        version=migration.version,
+                        name=migration.name,
+                        applied_at=datetime.utcnow()
+                    ))
+                applied.append(migration)
+        finally:
+            if is_postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+                conn.commit()
+    return applied
+
+
+def status(engine: Engine) -> list[tuple[Migration, bool]]:
+    """Every known migration and whether it has been applied"""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [(migration, migration.version in done) for migration in MIGRATIONS]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Boolean, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Boolean, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -77,6 +77,10 @@ class BOMItem(Base):
     quantity = Column(Float, nullable=False)
     
     bom = relationship("BOM", back_populates="items")
+    
+    __table_args__ = (
+        Index('ix_bom_items_bom_article', 'bom_id', 'sap_article'),
+    )
 
 
 class ScanSession(Base):
@@ -90,10 +94,18 @@ class ScanSession(Base):
     started_at = Column(DateTime, default=datetime.utcnow)
     ended_at = Column(DateTime, nullable=True)
     is_active = Column(Boolean, default=True)
+    # Bumped in the same transaction as every change to article_totals (aggregate deltas)
+    totals_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     user = relationship("User", back_populates="scan_sessions")
     bom = relationship("BOM")
     records = relationship("ScanRecord", back_populates="session", cascade="all, delete-orphan")
+    article_totals = relationship("SessionArticleTotal", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Active sessions of a user, newest first (overview, session list)
+        Index('ix_scan_sessions_user_active_started', 'user_id', 'is_active', 'started_at'),
+    )
 
 
 class ScanRecord(Base):
@@ -113,5 +125,39 @@ class ScanRecord(Base):
     # BOM comparison fields
     expected_quantity = Column(Float, nullable=True)
     status = Column(Enum(StatusEnum), nullable=True)
+    # Client-generated UUID, lets retried submissions be recognized
+    client_scan_id = Column(String(36), unique=True, index=True, nullable=True)
     
     session = relationship("ScanSession", back_populates="records")
+    
+    __table_args__ = (
+        Index('ix_scan_records_session_article', 'session_id', 'sap_article'),
+        Index('ix_scan_records_session_status', 'session_id', 'status'),
+    )
+
+
+# Maintained in the same transaction as scan_records writes (see totals.py)
+class SessionArticleTotal(Base):
+    __tablename__ = "session_article_totals"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("scan_sessions.id"), nullable=False)
+    sap_article = Column(String, nullable=False)
+    detected_category = Column(Enum(CategoryEnum), nullable=True)
+    part_number = Column(String, nullable=True)
+    description = Column(String, nullable=True)
+    total_qty = Column(Float, nullable=False, default=0.0)
+    scan_count = Column(Integer, nullable=False, default=0)
+    # scan_count split by the status stored on each record
+    match_scans = Column(Integer, nullable=False, default=0, server_default="0")
+    over_scans = Column(Integer, nullable=False, default=0, server_default="0")
+    under_scans = Column(Integer, nullable=False, default=0, server_default="0")
+    pending_scans = Column(Integer, nullable=False, default=0, server_default="0")
+    first_scan = Column(DateTime, nullable=True)
+    last_scan = Column(DateTime, nullable=True)
+    expected_qty = Column(Float, nullable=True)
+    status = Column(Enum(StatusEnum), nullable=True)
+    
+    __table_args__ = (
+        UniqueConstraint('session_id', 'sap_article', 'detected_category', name='uix_session_article_totals'),
+    )
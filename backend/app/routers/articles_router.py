@@ -1,18 +1,24 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 from .. import models, schemas, auth
-from ..database import get_db
+from ..database import get_db, get_async_db
 from ..excel_handler import parse_articles_excel
+from ..cache import article_catalog
 
 router = APIRouter(prefix="/articles", tags=["articles"])
+logger = logging.getLogger(__name__)
 
 
 @router.post("/upload", response_model=schemas.UploadResponse)
 async def upload_articles(
     file: UploadFile = File(...),
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload article database from Excel file"""
     if not file.filename.endswith(('.xlsx', '.xls', '.xlsm')):
@@ -20,12 +26,13 @@ async def upload_articles(
     
     try:
         content = await file.read()
-        articles_data = parse_articles_excel(content)
+        articles_data = await run_in_threadpool(parse_articles_excel, content)
         
         # Delete existing articles and commit
-        deleted_count = db.query(models.Article).delete()
-        db.commit()
-        print(f"Deleted {deleted_count} existing articles")
+        result = await db.execute(delete(models.Article))
+        deleted_count = result.rowcount
+        await db.commit()
+        logger.info("Deleted %d existing articles", deleted_count)
         
         # Check for duplicates in uploaded file (same SAP + same Category)
         article_keys = [(a['sap_article'], a['category']) for a in articles_data]
@@ -40,8 +47,9 @@ async def upload_articles(
             db.add(db_article)
             created_articles.append(article_data)
         
-        db.commit()
-        print(f"Successfully inserted {len(created_articles)} articles")
+        await db.commit()
+        await db.run_sync(article_catalog.load)
+        logger.info("Successfully inserted %d articles", len(created_articles))
         
         return schemas.UploadResponse(
             message=f"Successfully uploaded {len(created_articles)} articles",
@@ -50,9 +58,11 @@ async def upload_articles(
         )
     
     except ValueError as e:
+        article_catalog.invalidate()
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        article_catalog.invalidate()
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 
@@ -62,7 +72,7 @@ def get_articles(
     limit: int = 100,
     category: str = None,
     search: str = None,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all articles with optional filtering"""
@@ -85,13 +95,11 @@ def get_articles(
 @router.get("/{sap_article}", response_model=schemas.Article)
 def get_article(
     sap_article: str,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get article by SAP article number"""
-    article = db.query(models.Article).filter(
-        models.Article.sap_article == sap_article
-    ).first()
+    article = article_catalog.first(db, sap_article)
     
     if not article:
         raise HTTPException(status_code=404, detail="Article not found")
@@ -101,7 +109,7 @@ def get_article(
 
 @router.get("/stats/count")
 def get_article_stats(
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get article statistics"""
@@ -122,12 +130,13 @@ def get_article_stats(
 
 @router.delete("/clear")
 def clear_all_articles(
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Delete all articles from database"""
     deleted_count = db.query(models.Article).delete()
     db.commit()
+    article_catalog.load(db)
     
     return {
         "message": f"Successfully deleted {deleted_count} articles",
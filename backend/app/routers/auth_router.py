@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from .. import models, schemas, auth
-from ..database import get_db
+from ..database import get_async_db
 from ..config import get_settings
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
@@ -10,34 +11,36 @@ settings = get_settings()
 
 
 @router.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user"""
-    # Check if user exists
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create new user
-    hashed_password = auth.get_password_hash(user.password)
-    db_user = models.User(
-        username=user.username,
-        email=user.email,
-        hashed_password=hashed_password
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    async with auth.login_slot():
+        # Check if user exists
+        result = await db.execute(select(models.User.id).where(models.User.username == user.username))
+        if result.first():
+            raise HTTPException(status_code=400, detail="Username already registered")
+        
+        result = await db.execute(select(models.User.id).where(models.User.email == user.email))
+        if result.first():
+            raise HTTPException(status_code=400, detail="Email already registered")
+        
+        # Create new user
+        hashed_password = await auth.hash_password(user.password)
+        db_user = models.User(
+            username=user.username,
+            email=user.email,
+            hashed_password=hashed_password
+        )
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        return db_user
 
 
 @router.post("/login", response_model=schemas.Token)
-def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
     """Login and get access token"""
-    user = auth.authenticate_user(db, user_credentials.username, user_credentials.password)
+    async with auth.login_slot():
+        user = await auth.authenticate_user(db, user_credentials.username, user_credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,6 +56,19 @@ def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
 
 
 @router.get("/me", response_model=schemas.User)
-async def get_current_user_info(current_user: models.User = Depends(auth.get_current_user)):
+async def get_current_user_info(
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
     """Get current user information"""
-    return current_user
+    # The principal only carries id/username/is_active, load the full row
+    user = await db.get(models.User, current_user.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+@router.get("/stats")
+async def get_auth_stats(current_user: auth.Principal = Depends(auth.get_current_user)):
+    """Hit rate of the verified token cache"""
+    return {"tokens": auth.token_cache.stats()}
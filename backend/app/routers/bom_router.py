@@ -1,11 +1,16 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 from .. import models, schemas, auth
-from ..database import get_db
+from ..database import get_db, get_async_db
 from ..excel_handler import parse_bom_excel
+from ..cache import bom_cache
 
 router = APIRouter(prefix="/boms", tags=["bom"])
+logger = logging.getLogger(__name__)
 
 
 @router.post("/upload", response_model=schemas.BOM)
@@ -13,8 +18,8 @@ async def upload_bom(
     name: str = Form(...),
     category: str = Form(...),
     file: UploadFile = File(...),
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload BOM from Excel file"""
     if not file.filename.endswith(('.xlsx', '.xls', '.xlsm')):
@@ -29,50 +34,39 @@ async def upload_bom(
     try:
         content = await file.read()
         # Pass category to filter BOM items
-        bom_items_data = parse_bom_excel(content, target_category=category)
+        bom_items_data = await run_in_threadpool(parse_bom_excel, content, target_category=category)
         
         if len(bom_items_data) == 0:
             raise ValueError(f"No items found for category '{category}'. The Excel may not have a category column, or all items were filtered out.")
         
-        # Create BOM
+        # Create BOM with its items (assigned through the relationship so
+        # they stay loaded for the response)
         db_bom = models.BOM(
             name=name,
             category=category_enum,
-            uploaded_by=current_user.id
+            uploaded_by=current_user.id,
+            items=[models.BOMItem(**item_data) for item_data in bom_items_data]
         )
         db.add(db_bom)
-        db.flush()
-        
-        # Create BOM items
-        for item_data in bom_items_data:
-            db_item = models.BOMItem(
-                bom_id=db_bom.id,
-                **item_data
-            )
-            db.add(db_item)
-        
-        db.commit()
-        db.refresh(db_bom)
+        await db.commit()
         
-        # Explicitly load items relationship
-        db.refresh(db_bom)
         items_count = len(db_bom.items)
-        print(f"✅ BOM created with {items_count} items: '{name}'")
+        logger.info("BOM created with %d items: '%s'", items_count, name)
         
         return db_bom
     
     except ValueError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 
 @router.get("/", response_model=List[schemas.BOM])
 def get_boms(
     category: str = None,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all BOMs with optional category filter"""
@@ -97,7 +91,7 @@ def get_boms(
         bom_dict = bom_data.dict()
         bom_dict['items_count'] = len(bom.items)
         response.append(bom_dict)
-        print(f"BOM '{bom.name}': {bom_dict['items_count']} items")
+        logger.debug("BOM '%s': %d items", bom.name, bom_dict['items_count'])
 
     return response
 
@@ -105,7 +99,7 @@ def get_boms(
 @router.get("/{bom_id}", response_model=schemas.BOM)
 def get_bom(
     bom_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get BOM by ID"""
@@ -120,7 +114,7 @@ def get_bom(
 @router.delete("/{bom_id}")
 def delete_bom(
     bom_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Delete BOM (soft delete)"""
@@ -131,6 +125,7 @@ def delete_bom(
     
     bom.is_active = False
     db.commit()
+    bom_cache.evict(bom_id)
     
     return {"message": "BOM deleted successfully"}
 
@@ -138,7 +133,7 @@ def delete_bom(
 @router.get("/{bom_id}/items", response_model=List[schemas.BOMItem])
 def get_bom_items(
     bom_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all items for a BOM"""
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import func, select
 from datetime import datetime
 from io import BytesIO
 from typing import Literal
@@ -15,33 +17,44 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 
 from .. import models, auth
-from ..database import get_db
+from ..database import get_async_db
 
 router = APIRouter(prefix="/reports", tags=["reports"])
 
 
-def get_session_full_data(session_id: int, db: Session, user_id: int):
+async def get_session_full_data(session_id: int, db: AsyncSession, user_id: int):
     """Get complete session data for report generation"""
     
-    # Get session
-    session = db.query(models.ScanSession).filter(
+    # Get session (with its BOM, report builders read session.bom outside the DB session)
+    result = await db.execute(select(models.ScanSession).options(
+        selectinload(models.ScanSession.bom)
+    ).where(
         models.ScanSession.id == session_id,
         models.ScanSession.user_id == user_id
-    ).first()
+    ))
+    session = result.scalars().first()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Get all scan records
-    records = db.query(models.ScanRecord).filter(
+    result = await db.execute(select(models.ScanRecord).where(
         models.ScanRecord.session_id == session_id
-    ).order_by(models.ScanRecord.sap_article).all()
-    
-    # Calculate statistics
-    total_records = len(records)
-    match_count = sum(1 for r in records if r.status == models.StatusEnum.MATCH)
-    over_count = sum(1 for r in records if r.status == models.StatusEnum.OVER)
-    under_count = sum(1 for r in records if r.status == models.StatusEnum.UNDER)
+    ).order_by(models.ScanRecord.sap_article))
+    records = result.scalars().all()
+    
+    # Statistics from the precomputed article totals (one row per article),
+    # counting scans by the status stored on each record
+    result = await db.execute(select(models.SessionArticleTotal).where(
+        models.SessionArticleTotal.session_id == session_id
+    ))
+    article_totals = result.scalars().all()
+    
+    total_records = sum(t.scan_count for t in article_totals)
+    match_count = sum(t.match_scans for t in article_totals)
+    over_count = sum(t.over_scans for t in article_totals)
+    under_count = sum(t.under_scans for t in article_totals)
+    scanned_articles = {t.sap_article for t in article_totals}
     
     # Get BOM info and missing items if applicable
     bom_items_count = 0
@@ -49,15 +62,14 @@ def get_session_full_data(session_id: int, db: Session, user_id: int):
     
     if session.bom_id:
         # Get all BOM items
-        bom_items = db.query(models.BOMItem).filter(
+        result = await db.execute(select(models.BOMItem).where(
             models.BOMItem.bom_id == session.bom_id
-        ).all()
+        ))
+        bom_items = result.scalars().all()
         
         bom_items_count = len(bom_items)
         
         # Find missing items (in BOM but not scanned)
-        scanned_articles = {r.sap_article for r in records}
-        
         for bom_item in bom_items:
             if bom_item.sap_article not in scanned_articles:
                 missing_items.append({
@@ -77,7 +89,7 @@ def get_session_full_data(session_id: int, db: Session, user_id: int):
     completion_pct = 0
     if bom_items_count > 0:
         # Count unique articles scanned vs total BOM items
-        scanned_unique = len({r.sap_article for r in records})
+        scanned_unique = len(scanned_articles)
         completion_pct = (scanned_unique / bom_items_count) * 100
     
     return {
@@ -441,8 +453,8 @@ def generate_excel_report(session_data: dict) -> BytesIO:
 async def generate_session_report(
     session_id: int,
     format: Literal["pdf", "excel", "json"] = "pdf",
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Generate comprehensive inventory report for a session
@@ -455,7 +467,7 @@ async def generate_session_report(
     """
     
     # Get session data
-    session_data = get_session_full_data(session_id, db, current_user.id)
+    session_data = await get_session_full_data(session_id, db, current_user.id)
     
     if format == "json":
         # Return JSON summary
@@ -481,7 +493,7 @@ async def generate_session_report(
     
     elif format == "pdf":
         # Generate PDF
-        pdf_buffer = generate_pdf_report(session_data)
+        pdf_buffer = await run_in_threadpool(generate_pdf_report, session_data)
         filename = f"inventory_report_session_{session_id}.pdf"
         
         return StreamingResponse(
@@ -492,7 +504,7 @@ async def generate_session_report(
     
     elif format == "excel":
         # Generate Excel
-        excel_buffer = generate_excel_report(session_data)
+        excel_buffer = await run_in_threadpool(generate_excel_report, session_data)
         filename = f"inventory_report_session_{session_id}.xlsx"
         
         return StreamingResponse(
@@ -505,15 +517,15 @@ async def generate_session_report(
 @router.get("/session/{session_id}/preview")
 async def preview_session_report(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get session completion data for preview before finalizing
     Used by frontend to show completion modal
     """
     
-    session_data = get_session_full_data(session_id, db, current_user.id)
+    session_data = await get_session_full_data(session_id, db, current_user.id)
     session = session_data["session"]
     stats = session_data["stats"]
     
@@ -550,31 +562,32 @@ async def preview_session_report(
 @router.get("/session/{session_id}/inventory-export")
 async def export_inventory_excel(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Export inventory count as simple Excel file (INVENTORY mode optimized)
     No BOM comparison - just article counts
     """
     # Get session
-    session = db.query(models.ScanSession).filter(
+    result = await db.execute(select(models.ScanSession).where(
         models.ScanSession.id == session_id,
         models.ScanSession.user_id == current_user.id
-    ).first()
+    ))
+    session = result.scalars().first()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Group by article, category and sum quantities  
-    grouped_records = db.query(
+    result = await db.execute(select(
         models.ScanRecord.sap_article,
         models.ScanRecord.part_number,
         models.ScanRecord.description,
         models.ScanRecord.detected_category,  # ⭐ AGREGAR
         func.sum(models.ScanRecord.quantity).label('total_quantity'),
         func.count(models.ScanRecord.id).label('scan_count')
-    ).filter(
+    ).where(
         models.ScanRecord.session_id == session_id
     ).group_by(
         models.ScanRecord.sap_article,
@@ -584,7 +597,8 @@ async def export_inventory_excel(
     ).order_by(
         models.ScanRecord.detected_category,  # ⭐ CAMBIAR - ordenar por categoría primero
         models.ScanRecord.sap_article
-    ).all()
+    ))
+    grouped_records = result.all()
     
     # Create Excel
     buffer = BytesIO()
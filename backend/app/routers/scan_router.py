@@ -1,21 +1,25 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Dict
+from sqlalchemy import func, select, delete
+from sqlalchemy.exc import IntegrityError
+from typing import List, Dict, Optional
 from datetime import datetime
-from .. import models, schemas, auth
-from ..database import get_db
+from .. import models, schemas, auth, totals, events, ingest
+from ..database import get_db, get_async_db
 from ..sse import sse_manager
-import json
+from ..cache import article_catalog, bom_cache, recent_scan_ids
 
 router = APIRouter(prefix="/scan", tags=["scanning"])
+logger = logging.getLogger(__name__)
 
 
 @router.post("/sessions", response_model=schemas.ScanSession)
 async def create_session(
     session_data: schemas.ScanSessionCreate,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new scan session"""
     # ⭐ NUEVA VALIDACIÓN
@@ -25,7 +29,7 @@ async def create_session(
         if not session_data.bom_id:
             raise HTTPException(status_code=400, detail="BOM ID required for BOM mode")
         
-        bom = db.query(models.BOM).filter(models.BOM.id == session_data.bom_id).first()
+        bom = await db.get(models.BOM, session_data.bom_id)
         if not bom:
             raise HTTPException(status_code=404, detail="BOM not found")
         
@@ -44,8 +48,7 @@ async def create_session(
     )
     
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.commit()
     
     return db_session
 
@@ -53,7 +56,7 @@ async def create_session(
 @router.get("/sessions", response_model=List[schemas.ScanSession])
 def get_sessions(
     active_only: bool = False,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all scan sessions for current user"""
@@ -103,7 +106,7 @@ def get_sessions(
 @router.get("/sessions/{session_id}", response_model=schemas.ScanSession)
 def get_session(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get session by ID"""
@@ -121,21 +124,22 @@ def get_session(
 @router.post("/sessions/{session_id}/end")
 async def end_session(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """End a scan session"""
-    session = db.query(models.ScanSession).filter(
+    result = await db.execute(select(models.ScanSession).where(
         models.ScanSession.id == session_id,
         models.ScanSession.user_id == current_user.id
-    ).first()
+    ))
+    session = result.scalars().first()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     session.is_active = False
     session.ended_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     return {"message": "Session ended successfully"}
 
@@ -143,37 +147,30 @@ async def end_session(
 @router.delete("/sessions/{session_id}")
 async def delete_session(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete a scan session and all its records"""
-    session = db.query(models.ScanSession).filter(
+    result = await db.execute(select(models.ScanSession).where(
         models.ScanSession.id == session_id,
         models.ScanSession.user_id == current_user.id
-    ).first()
+    ))
+    session = result.scalars().first()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     # Delete all records first (cascade should handle this, but being explicit)
-    db.query(models.ScanRecord).filter(
+    await db.execute(delete(models.ScanRecord).where(
         models.ScanRecord.session_id == session_id
-    ).delete()
+    ))
     
     # Delete the session
-    db.delete(session)
-    db.commit()
+    await db.delete(session)
+    await db.commit()
     
     # Broadcast SSE event
-    event_data = {
-        "event": "session_deleted",
-        "data": json.dumps({
-            "type": "session_deleted",
-            "session_id": session_id
-        })
-    }
-    
-    await sse_manager.broadcast_all(event_data)
+    await sse_manager.publish(session, events.session_deleted(session_id))
     
     return {"message": "Session deleted successfully"}
 
@@ -181,20 +178,36 @@ async def delete_session(
 @router.post("/records", response_model=schemas.ScanRecord)
 async def create_scan_record(
     record_data: schemas.ScanRecordCreate,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new scan record"""
-    print(f"\n{'='*60}")
-    print(f"📥 Received scan: {record_data.sap_article} x{record_data.quantity}")
-    print(f"   Session: {record_data.session_id}, User: {current_user.username}")
-    print(f"{'='*60}\n")
+    return await ingest.create_scan(db, current_user, record_data)
+
+
+@router.post("/records/batch", response_model=List[schemas.ScanRecord])
+async def create_scan_records_batch(
+    batch: schemas.ScanRecordBatchCreate,
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Create many scan records in a single transaction (pallet sweeps).
+    Articles and BOM quantities come from the in-memory caches, running
+    totals from the session's totals rows, and a single scan_batch event
+    is published. Records whose
+    client_scan_id was already accepted are returned as they are.
+    """
+    session_ids = {record_data.session_id for record_data in batch.records}
+    if len(session_ids) != 1:
+        raise HTTPException(status_code=400, detail="All records in a batch must belong to the same session")
     
     # Validate session
-    session = db.query(models.ScanSession).filter(
-        models.ScanSession.id == record_data.session_id,
+    result = await db.execute(select(models.ScanSession).where(
+        models.ScanSession.id == session_ids.pop(),
         models.ScanSession.user_id == current_user.id
-    ).first()
+    ))
+    session = result.scalars().first()
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -202,102 +215,105 @@ async def create_scan_record(
     if not session.is_active:
         raise HTTPException(status_code=400, detail="Session is not active")
     
-    # Look up article in database
-    article = db.query(models.Article).filter(
-        models.Article.sap_article == record_data.sap_article
-    ).first()
-
-    # Auto-detect category from article database
-    detected_cat = None
-    if article:
-        detected_cat = article.category
-    elif record_data.detected_category:
-        # Use manually provided category (for articles not in DB)
-        detected_cat = record_data.detected_category
-    else:
-        # Fallback to session category
-        detected_cat = session.category
-
-    print(f"   🏷️  Category detected: {detected_cat.value if detected_cat else 'None'}")
-
-    # Create scan record
-    db_record = models.ScanRecord(
-        session_id=record_data.session_id,
-        sap_article=record_data.sap_article,
-        part_number=article.part_number if article else None,
-        description=article.description if article else None,
-        detected_category=detected_cat,  # ⭐ NUEVO
-        po_number=record_data.po_number,
-        quantity=record_data.quantity,
-        manual_entry=record_data.manual_entry
-    )
+    # Originals of retried scans, looked up once so a duplicate doesn't abort the batch
+    client_scan_ids = {str(record_data.client_scan_id) for record_data in batch.records if record_data.client_scan_id}
+    originals = {}
+    if client_scan_ids:
+        result = await db.execute(select(models.ScanRecord).where(
+            models.ScanRecord.client_scan_id.in_(client_scan_ids)
+        ))
+        originals = {
+            original.client_scan_id: ingest.original_scan(original, session.id)
+            for original in result.scalars()
+        }
     
-    # If in BOM mode, calculate comparison
-    if session.mode == models.ModeEnum.BOM and session.bom_id:
-        # Get BOM item
-        bom_item = db.query(models.BOMItem).filter(
-            models.BOMItem.bom_id == session.bom_id,
-            models.BOMItem.sap_article == record_data.sap_article
-        ).first()
+    sap_articles = {record_data.sap_article for record_data in batch.records}
+    
+    # Look up all articles in the catalog index
+    articles = {sap_article: await article_catalog.afirst(db, sap_article) for sap_article in sap_articles}
+    
+    is_bom_session = session.mode == models.ModeEnum.BOM and session.bom_id
+    bom_quantities = {}
+    if is_bom_session:
+        bom_quantities = await bom_cache.aget(db, session.bom_id)
+    
+    db_records = []
+    response = []
+    for record_data in batch.records:
+        client_scan_id = str(record_data.client_scan_id) if record_data.client_scan_id else None
+        if client_scan_id in originals:
+            response.append(originals[client_scan_id])
+            continue
         
-        if bom_item:
-            db_record.expected_quantity = bom_item.quantity
-            
-            # Count total scanned quantity for this article in this session
-            total_scanned = db.query(func.sum(models.ScanRecord.quantity)).filter(
-                models.ScanRecord.session_id == session.id,
-                models.ScanRecord.sap_article == record_data.sap_article
-            ).scalar() or 0.0
-            
-            total_scanned += record_data.quantity
-            
-            # Determine status
-            if total_scanned == bom_item.quantity:
-                db_record.status = models.StatusEnum.MATCH
-            elif total_scanned > bom_item.quantity:
-                db_record.status = models.StatusEnum.OVER
-            else:
-                db_record.status = models.StatusEnum.UNDER
+        article = articles.get(record_data.sap_article)
+        
+        # Auto-detect category from article database
+        if article:
+            detected_cat = article.category
+        elif record_data.detected_category:
+            detected_cat = record_data.detected_category
         else:
-            # Article not in BOM
-            db_record.status = models.StatusEnum.OVER
-    
-    db.add(db_record)
-    db.commit()
-    db.refresh(db_record)
+            detected_cat = session.category
+        
+        db_record = models.ScanRecord(
+            session_id=session.id,
+            sap_article=record_data.sap_article,
+            part_number=article.part_number if article else None,
+            description=article.description if article else None,
+            detected_category=detected_cat,
+            po_number=record_data.po_number,
+            quantity=record_data.quantity,
+            manual_entry=record_data.manual_entry,
+            client_scan_id=client_scan_id
+        )
+        
+        if is_bom_session:
+            expected_qty = bom_quantities.get(record_data.sap_article)
+            if expected_qty is not None:
+                # Compared with the running total by totals.add_records
+                db_record.expected_quantity = expected_qty
+            else:
+                # Article not in BOM
+                db_record.status = models.StatusEnum.OVER
+        
+        if client_scan_id:
+            # Repeated IDs inside the batch count once
+            originals[client_scan_id] = db_record
+        db_records.append(db_record)
+        response.append(db_record)
+    
+    if not db_records:
+        return response
+    
+    session_id = session.id
+    db.add_all(db_records)
+    try:
+        await totals.add_records(db, db_records)
+        aggregate = await totals.session_aggregate(
+            db, session_id, totals.changed_articles(db_records)[session_id]
+        )
+        await db.commit()
+    except IntegrityError:
+        # Same client_scan_id committed concurrently by another request
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Batch contains a scan submitted concurrently, retry the batch")
     
-    # Broadcast SSE event
-    event_data = {
-        "event": "scan",
-        "data": json.dumps({
-            "type": "scan",
-            "session_id": session.id,
-            "record": {
-                "id": db_record.id,
-                "sap_article": db_record.sap_article,
-                "part_number": db_record.part_number,
-                "description": db_record.description,
-                "po_number": db_record.po_number,
-                "quantity": db_record.quantity,
-                "scanned_at": db_record.scanned_at.isoformat(),
-                "manual_entry": db_record.manual_entry,
-                "expected_quantity": db_record.expected_quantity,
-                "status": db_record.status.value if db_record.status else None,
-                "detected_category": db_record.detected_category.value if db_record.detected_category else None
-            }
-        })
-    }
+    for db_record in db_records:
+        if db_record.client_scan_id:
+            recent_scan_ids.remember(db_record.client_scan_id, db_record.id)
     
-    await sse_manager.broadcast(session.id, event_data)
-    await sse_manager.broadcast_all(event_data)  # Also broadcast to panel
+    # Broadcast a single coalesced SSE event
+    event = events.scan_batch(session.id, db_records)
+    await sse_manager.publish(session, event)
+    await sse_manager.publish(session, events.aggregate(aggregate))
     
-    return db_record
+    return response
 
 
 @router.get("/sessions/{session_id}/records", response_model=List[schemas.ScanRecord])
 def get_session_records(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all scan records for a session"""
@@ -315,7 +331,7 @@ def get_session_records(
 @router.get("/sessions/{session_id}/summary")
 def get_session_summary(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get summary of scan session with BOM comparison - showing individual records"""
@@ -381,44 +397,57 @@ def get_session_summary(
     }
 
 
+@router.get("/sessions/{session_id}/aggregate")
+async def get_session_aggregate(
+    session_id: int,
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Snapshot of the session counters at a version. aggregate SSE events
+    with a higher version are applied on top of it; a jump of more than
+    one version means one was missed and the snapshot is fetched again.
+    """
+    result = await db.execute(select(models.ScanSession.id).where(
+        models.ScanSession.id == session_id,
+        models.ScanSession.user_id == current_user.id
+    ))
+    if result.scalar() is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return await totals.session_aggregate(db, session_id)
+
+
 @router.delete("/records/{record_id}")
 async def delete_scan_record(
     record_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete a scan record (admin only or owner)"""
     # Get the record
-    record = db.query(models.ScanRecord).filter(
-        models.ScanRecord.id == record_id
-    ).first()
+    record = await db.get(models.ScanRecord, record_id)
     
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     
     # Check permission - must be owner of session or admin
-    session = db.query(models.ScanSession).filter(
-        models.ScanSession.id == record.session_id
-    ).first()
+    session = await db.get(models.ScanSession, record.session_id)
     
     if session.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this record")
     
-    db.delete(record)
-    db.commit()
+    sap_article = record.sap_article
+    await db.delete(record)
+    await db.flush()
+    await totals.remove_record(db, record)
+    aggregate = await totals.session_aggregate(db, session.id, [(sap_article, record.detected_category)])
+    await db.commit()
     
     # Broadcast SSE event
-    event_data = {
-        "event": "record_deleted",
-        "data": json.dumps({
-            "type": "record_deleted",
-            "session_id": session.id,
-            "record_id": record_id
-        })
-    }
-    
-    await sse_manager.broadcast(session.id, event_data)
-    await sse_manager.broadcast_all(event_data)
+    event = events.record_deleted(record)
+    await sse_manager.publish(session, event)
+    await sse_manager.publish(session, events.aggregate(aggregate))
     
     return {"message": "Record deleted successfully"}
 
@@ -427,78 +456,47 @@ async def delete_scan_record(
 async def update_scan_record(
     record_id: int,
     quantity: float,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update scan record quantity (admin only or owner)"""
     # Get the record
-    record = db.query(models.ScanRecord).filter(
-        models.ScanRecord.id == record_id
-    ).first()
+    record = await db.get(models.ScanRecord, record_id)
     
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     
     # Check permission
-    session = db.query(models.ScanSession).filter(
-        models.ScanSession.id == record.session_id
-    ).first()
+    session = await db.get(models.ScanSession, record.session_id)
     
     if session.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to update this record")
     
     # Update quantity
+    quantity_delta = quantity - record.quantity
     record.quantity = quantity
     
     # Recalculate status if in BOM mode
+    expected_qty = None
     if session.mode == models.ModeEnum.BOM and session.bom_id:
-        bom_item = db.query(models.BOMItem).filter(
-            models.BOMItem.bom_id == session.bom_id,
-            models.BOMItem.sap_article == record.sap_article
-        ).first()
-        
-        if bom_item:
-            # Count total scanned quantity for this article in this session
-            total_scanned = db.query(func.sum(models.ScanRecord.quantity)).filter(
-                models.ScanRecord.session_id == session.id,
-                models.ScanRecord.sap_article == record.sap_article
-            ).scalar() or 0.0
-            
-            # Determine status
-            if total_scanned == bom_item.quantity:
-                record.status = models.StatusEnum.MATCH
-            elif total_scanned > bom_item.quantity:
-                record.status = models.StatusEnum.OVER
-            else:
-                record.status = models.StatusEnum.UNDER
+        expected_qty = await bom_cache.aexpected_quantity(db, session.bom_id, record.sap_article)
     
-    db.commit()
-    db.refresh(record)
+    # Status is compared with the article's total including this edit
+    await totals.update_record(db, record, quantity_delta, expected_qty)
+    aggregate = await totals.session_aggregate(db, session.id, [(record.sap_article, record.detected_category)])
+    await db.commit()
     
     # Broadcast SSE event
-    event_data = {
-        "event": "record_updated",
-        "data": json.dumps({
-            "type": "record_updated",
-            "session_id": session.id,
-            "record": {
-                "id": record.id,
-                "sap_article": record.sap_article,
-                "quantity": record.quantity,
-                "status": record.status.value if record.status else None
-            }
-        })
-    }
-    
-    await sse_manager.broadcast(session.id, event_data)
-    await sse_manager.broadcast_all(event_data)
+    event = events.record_updated(record)
+    await sse_manager.publish(session, event)
+    await sse_manager.publish(session, events.aggregate(aggregate))
     
     return record
 
 
 @router.get("/overview")
 def get_inventory_overview(
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -543,10 +541,25 @@ def get_inventory_overview(
             total_under = 0
             expected_items = 0
             
+            # Scan counts per status for all active sessions in one query
+            status_counts = db.query(
+                models.SessionArticleTotal.session_id,
+                func.sum(models.SessionArticleTotal.scan_count),
+                func.sum(models.SessionArticleTotal.match_scans),
+                func.sum(models.SessionArticleTotal.over_scans),
+                func.sum(models.SessionArticleTotal.under_scans)
+            ).filter(
+                models.SessionArticleTotal.session_id.in_([session.id for session in active_sessions])
+            ).group_by(models.SessionArticleTotal.session_id).all()
+            
+            session_counts: Dict[int, tuple] = {
+                session_id: counts for session_id, *counts in status_counts
+            }
+            
             for session in active_sessions:
-                session_scanned = db.query(func.count(models.ScanRecord.id)).filter(
-                    models.ScanRecord.session_id == session.id
-                ).scalar() or 0
+                session_scanned, session_match, session_over, session_under = session_counts.get(
+                    session.id, (0, 0, 0, 0)
+                )
                 
                 session_expected = 0
                 if session.bom_id:
@@ -554,21 +567,6 @@ def get_inventory_overview(
                         models.BOMItem.bom_id == session.bom_id
                     ).scalar() or 0
                 
-                session_match = db.query(func.count(models.ScanRecord.id)).filter(
-                    models.ScanRecord.session_id == session.id,
-                    models.ScanRecord.status == models.StatusEnum.MATCH
-                ).scalar() or 0
-                
-                session_over = db.query(func.count(models.ScanRecord.id)).filter(
-                    models.ScanRecord.session_id == session.id,
-                    models.ScanRecord.status == models.StatusEnum.OVER
-                ).scalar() or 0
-                
-                session_under = db.query(func.count(models.ScanRecord.id)).filter(
-                    models.ScanRecord.session_id == session.id,
-                    models.ScanRecord.status == models.StatusEnum.UNDER
-                ).scalar() or 0
-                
                 total_scanned += session_scanned
                 total_match += session_match
                 total_over += session_over
@@ -650,41 +648,32 @@ def get_inventory_overview(
     
     if inventory_active_sessions:
         inventory_status = "in_progress"
+        # Precomputed article totals of all active INVENTORY sessions
+        inventory_totals: Dict[int, list] = {}
+        for row in db.query(models.SessionArticleTotal).filter(
+            models.SessionArticleTotal.session_id.in_([session.id for session in inventory_active_sessions])
+        ):
+            inventory_totals.setdefault(row.session_id, []).append(row)
+        
         for session in inventory_active_sessions:
-            session_scanned = db.query(func.count(models.ScanRecord.id)).filter(
-                models.ScanRecord.session_id == session.id
-            ).scalar() or 0
-            
-            # Calculate match/over/under counts by comparing against BOMs
-            # Group records by article and detected_category, sum quantities
-            article_totals = db.query(
-                models.ScanRecord.sap_article,
-                models.ScanRecord.detected_category,
-                func.sum(models.ScanRecord.quantity).label('total_qty')
-            ).filter(
-                models.ScanRecord.session_id == session.id
-            ).group_by(
-                models.ScanRecord.sap_article,
-                models.ScanRecord.detected_category
-            ).all()
+            article_totals = inventory_totals.get(session.id, [])
+            session_scanned = sum(row.scan_count for row in article_totals)
             
+            # Calculate match/over/under counts by comparing article totals against BOMs
             session_match = 0
             session_over = 0
             session_under = 0
             session_expected = 0
             
-            for sap_article, detected_cat, total_qty in article_totals:
+            for row in article_totals:
+                sap_article, detected_cat, total_qty = row.sap_article, row.detected_category, row.total_qty
                 if detected_cat and detected_cat in active_boms:
                     # Find BOM item for this category
                     bom = active_boms[detected_cat]
-                    bom_item = db.query(models.BOMItem).filter(
-                        models.BOMItem.bom_id == bom.id,
-                        models.BOMItem.sap_article == sap_article
-                    ).first()
+                    expected_qty = bom_cache.expected_quantity(db, bom.id, sap_article)
                     
-                    if bom_item:
+                    if expected_qty is not None:
                         session_expected += 1
-                        expected_qty = bom_item.quantity
                         if total_qty == expected_qty:
                             session_match += 1
                         elif total_qty > expected_qty:
@@ -731,29 +720,30 @@ def get_inventory_overview(
 
 @router.delete("/sessions/cleanup/dev")
 async def cleanup_dev_sessions(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete all sessions that have no scan records (for development cleanup)
     """
     # Find sessions with no records
-    empty_sessions = db.query(models.ScanSession).filter(
+    result = await db.execute(select(models.ScanSession).where(
         models.ScanSession.user_id == current_user.id
-    ).all()
+    ))
+    empty_sessions = result.scalars().all()
     
     deleted_count = 0
     for session in empty_sessions:
         # Check if session has any records
-        record_count = db.query(func.count(models.ScanRecord.id)).filter(
+        record_count = await db.scalar(select(func.count(models.ScanRecord.id)).where(
             models.ScanRecord.session_id == session.id
-        ).scalar()
+        ))
         
         if record_count == 0:
-            db.delete(session)
+            await db.delete(session)
             deleted_count += 1
     
-    db.commit()
+    await db.commit()
     
     return {
         "message": f"Deleted {deleted_count} empty sessions",
@@ -764,7 +754,7 @@ async def cleanup_dev_sessions(
 @router.get("/sessions/{session_id}/inventory-summary")
 def get_inventory_summary(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -779,38 +769,24 @@ def get_inventory_summary(
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Group by article and sum quantities
-    grouped_records = db.query(
-        models.ScanRecord.sap_article,
-        models.ScanRecord.part_number,
-        models.ScanRecord.description,
-        models.ScanRecord.detected_category,  # ← AGREGAR
-        func.sum(models.ScanRecord.quantity).label('total_quantity'),
-        func.count(models.ScanRecord.id).label('scan_count'),
-        func.min(models.ScanRecord.scanned_at).label('first_scan'),
-        func.max(models.ScanRecord.scanned_at).label('last_scan')
-    ).filter(
-        models.ScanRecord.session_id == session_id
-    ).group_by(
-        models.ScanRecord.sap_article,
-        models.ScanRecord.part_number,
-        models.ScanRecord.description,
-        models.ScanRecord.detected_category  # ← AGREGAR
+    # Precomputed per-article totals (session_article_totals)
+    article_totals = db.query(models.SessionArticleTotal).filter(
+        models.SessionArticleTotal.session_id == session_id
     ).order_by(
-        models.ScanRecord.sap_article
+        models.SessionArticleTotal.sap_article
     ).all()
 
     items = []
-    for record in grouped_records:
+    for row in article_totals:
         items.append({
-            "sap_article": record.sap_article,
-            "part_number": record.part_number,
-            "description": record.description,
-            "detected_category": record.detected_category.value if record.detected_category else None,  # ← AGREGAR
-            "total_quantity": float(record.total_quantity),
-            "scan_count": record.scan_count,
-            "first_scan": record.first_scan.isoformat(),
-            "last_scan": record.last_scan.isoformat()
+            "sap_article": row.sap_article,
+            "part_number": row.part_number,
+            "description": row.description,
+            "detected_category": row.detected_category.value if row.detected_category else None,  # ← AGREGAR
+            "total_quantity": float(row.total_qty),
+            "scan_count": row.scan_count,
+            "first_scan": row.first_scan.isoformat(),
+            "last_scan": row.last_scan.isoformat()
         })
     
     total_unique_items = len(items)
@@ -837,7 +813,7 @@ def get_inventory_summary(
 @router.get("/sessions/{session_id}/inventory-summary-by-category")
 def get_inventory_summary_by_category(
     session_id: int,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: auth.Principal = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -852,53 +828,32 @@ def get_inventory_summary_by_category(
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Group by detected_category and article
-    from sqlalchemy import case
-    
-    grouped_by_category = db.query(
-        models.ScanRecord.detected_category,
-        func.count(func.distinct(models.ScanRecord.sap_article)).label('unique_items'),
-        func.sum(models.ScanRecord.quantity).label('total_quantity'),
-        func.count(models.ScanRecord.id).label('scan_count')
-    ).filter(
-        models.ScanRecord.session_id == session_id
-    ).group_by(
-        models.ScanRecord.detected_category
+    # Group the precomputed article totals by detected_category
+    article_totals = db.query(models.SessionArticleTotal).filter(
+        models.SessionArticleTotal.session_id == session_id
     ).all()
     
+    grouped_by_category: Dict[Optional[models.CategoryEnum], list] = {}
+    for row in article_totals:
+        grouped_by_category.setdefault(row.detected_category, []).append(row)
+    
     category_breakdown = []
-    for cat, unique_items, total_qty, scan_count in grouped_by_category:
-        # Get items for this category
-        items = db.query(
-            models.ScanRecord.sap_article,
-            models.ScanRecord.part_number,
-            models.ScanRecord.description,
-            func.sum(models.ScanRecord.quantity).label('total_quantity'),
-            func.count(models.ScanRecord.id).label('scan_count')
-        ).filter(
-            models.ScanRecord.session_id == session_id,
-            models.ScanRecord.detected_category == cat
-        ).group_by(
-            models.ScanRecord.sap_article,
-            models.ScanRecord.part_number,
-            models.ScanRecord.description
-        ).all()
-        
+    for cat, rows in grouped_by_category.items():
         category_breakdown.append({
             "category": cat.value if cat else "UNKNOWN",
-            "unique_items": unique_items,
-            "total_quantity": float(total_qty or 0),
-            "scan_count": scan_count,
+            "unique_items": len({row.sap_article for row in rows}),
+            "total_quantity": float(sum(row.total_qty for row in rows)),
+            "scan_count": sum(row.scan_count for row in rows),
             "items": [
                 {
-                    "sap_article": item.sap_article,
-                    "part_number": item.part_number,
-                    "description": item.description,
+                    "sap_article": row.sap_article,
+                    "part_number": row.part_number,
+                    "description": row.description,
                     "detected_category": cat.value if cat else "UNKNOWN",  # ← AGREGAR (ya tenemos cat del loop)
-                    "total_quantity": float(item.total_quantity),
-                    "scan_count": item.scan_count
+                    "total_quantity": float(row.total_qty),
+                    "scan_count": row.scan_count
                 }
-                for item in items
+                for row in rows
             ]
         })
     
@@ -920,21 +875,23 @@ def get_inventory_summary_by_category(
     # Al final de scan_router.py, después de la línea 918
 @router.get("/last-update")
 async def get_last_update(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get timestamp of last update to trigger frontend refresh"""
     # Get most recent scan record
-    last_record = db.query(models.ScanRecord).join(
+    result = await db.execute(select(models.ScanRecord).join(
         models.ScanSession
-    ).filter(
+    ).where(
         models.ScanSession.user_id == current_user.id
-    ).order_by(models.ScanRecord.scanned_at.desc()).first()
+    ).order_by(models.ScanRecord.scanned_at.desc()).limit(1))
+    last_record = result.scalars().first()
     
     # Get most recently updated session
-    last_session = db.query(models.ScanSession).filter(
+    result = await db.execute(select(models.ScanSession).where(
         models.ScanSession.user_id == current_user.id
-    ).order_by(models.ScanSession.started_at.desc()).first()
+    ).order_by(models.ScanSession.started_at.desc()).limit(1))
+    last_session = result.scalars().first()
     
     last_update = None
     if last_record:
@@ -1,51 +1,106 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Header
+from jose import JWTError
 from sse_starlette.sse import EventSourceResponse
-from sqlalchemy.orm import Session
 from .. import auth, models
-from ..sse import sse_manager, event_generator
-from ..database import get_db
+from ..sse import sse_manager, event_generator, EventFilter, SSE_PING_DISABLED
 
 router = APIRouter(prefix="/events", tags=["sse"])
+logger = logging.getLogger(__name__)
+
+
+def _split(value: Optional[str]) -> Optional[list[str]]:
+    """Comma separated query parameter"""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _enum_values(name: str, value: Optional[str], enum_type) -> Optional[list[str]]:
+    items = _split(value)
+    allowed = {member.value for member in enum_type}
+    if items and not allowed.issuperset(items):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected any of: {', '.join(sorted(allowed))}")
+    return items
+
+
+def _ids(name: str, value: Optional[str]) -> Optional[list[int]]:
+    items = _split(value)
+    if items and not all(item.isdigit() for item in items):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected comma separated IDs")
+    return [int(item) for item in items] if items else None
 
 
 @router.get("/stream")
 async def stream_events(
     token: str = Query(None),
     session_id: int = None,
-    db: Session = Depends(get_db)
+    last_event_id: str = Query(None),
+    last_event_id_header: str = Header(None, alias="Last-Event-ID"),
+    categories: str = Query(None, description="Comma separated detected categories"),
+    modes: str = Query(None, description="Comma separated session modes"),
+    users: str = Query(None, description="Comma separated user IDs"),
+    sessions: str = Query(None, description="Comma separated session IDs"),
+    types: str = Query(None, description="Comma separated event types"),
+    fields: str = Query(None, description="Comma separated record fields to send")
 ):
     """
     SSE endpoint for real-time updates.
     Token can be passed as query parameter for EventSource compatibility.
     If session_id is provided, only events for that session are streamed.
     Otherwise, all events are streamed (for web panel).
+    Events missed since Last-Event-ID (header sent by EventSource on
+    reconnect, or last_event_id query parameter) are replayed first.
+    The optional filters are applied before events are queued, so a
+    panel only receives (and the server only buffers) what it shows.
+
+    No database dependency here: a yield dependency is only closed once the
+    response ends, so it would pin a pooled connection for the whole stream.
+    The token is checked by signature alone.
     """
     # Verify token if provided
     if token:
         try:
-            from ..auth import verify_token
-            payload = verify_token(token)
-            # Token is valid
-        except Exception as e:
-            print(f"SSE Token validation error: {str(e)}")
+            auth.verify_token(token)
+        except JWTError as e:
+            logger.warning("SSE token validation error: %s", e)
             raise HTTPException(status_code=403, detail=f"Invalid or expired token: {str(e)}")
     
     # For web panel, use session_id = 0 to get all events
     if session_id is None:
         session_id = 0
     
-    queue = await sse_manager.connect(session_id)
+    event_filter = None
+    if categories or modes or users or sessions or types or fields:
+        event_filter = EventFilter(
+            categories=_enum_values("categories", categories, models.CategoryEnum),
+            modes=_enum_values("modes", modes, models.ModeEnum),
+            user_ids=_ids("users", users),
+            session_ids=_ids("sessions", sessions),
+            event_types=_split(types),
+            fields=_split(fields)
+        )
+    
+    subscriber = await sse_manager.connect(session_id, last_event_id_header or last_event_id, event_filter)
     
     # Don't use finally block - let the generator handle cleanup
     async def event_stream():
         try:
-            async for event in event_generator(queue):
+            async for event in event_generator(subscriber):
                 yield event
         finally:
-            print(f"🔌 SSE: Client disconnected from session {session_id}")
-            sse_manager.disconnect(session_id, queue)
+            logger.info("SSE client disconnected from session %s", session_id)
+            sse_manager.disconnect(subscriber)
     
-    return EventSourceResponse(event_stream())
+    # Pings come from the shared SSEManager heartbeat, not a timer per response
+    return EventSourceResponse(event_stream(), ping=SSE_PING_DISABLED)
+
+
+@router.get("/stats")
+async def stream_stats(current_user: auth.Principal = Depends(auth.get_current_user)):
+    """Per-connection queue depth, drops and lag of the SSE subscribers"""
+    return sse_manager.stats()
 
 
 @router.get("/ping")
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from jose import JWTError
+from pydantic import ValidationError
+from sqlalchemy import select
+from .. import models, schemas, auth, events, ingest
+from ..database import AsyncSessionLocal
+from ..sse import sse_manager
+
+router = APIRouter(prefix="/ws", tags=["websocket"])
+logger = logging.getLogger(__name__)
+
+
+def _ack(seq, **fields) -> str:
+    return events.dumps({"type": "ack", "seq": seq, **fields}).decode()
+
+
+async def _authenticate(websocket: WebSocket, token: Optional[str], session_id: int) -> Optional[auth.Principal]:
+    """Principal of the JWT (token query parameter or Bearer header), if it owns the session"""
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials
+    if not token:
+        return None
+    try:
+        username = auth.verify_token(token)["sub"]
+    except JWTError as e:
+        logger.warning("WebSocket token validation error: %s", e)
+        return None
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(models.User).join(models.ScanSession).where(
+            models.User.username == username,
+            models.ScanSession.id == session_id
+        ))
+        user = result.scalars().first()
+    if user is None or not user.is_active:
+        return None
+    return auth.principal_cache.remember(user)
+
+
+async def _handle_frame(frame: str, user: auth.Principal, session_id: int) -> str:
+    """Ingest one scan frame and build its ack"""
+    try:
+        message = events.loads(frame)
+    except ValueError:
+        return _ack(None, ok=False, status_code=400, detail="Invalid JSON")
+    if not isinstance(message, dict) or message.get("type") != "scan":
+        return _ack(None, ok=False, status_code=400, detail="Unknown frame type")
+
+    seq = message.get("seq")
+    message.setdefault("session_id", session_id)
+    try:
+        record_data = schemas.ScanRecordCreate.model_validate(message)
+        async with AsyncSessionLocal() as db:
+            record = await ingest.create_scan(db, user, record_data)
+    except ValidationError as e:
+        return _ack(seq, ok=False, status_code=422,
+                    detail=e.errors(include_url=False, include_context=False, include_input=False))
+    except HTTPException as e:
+        return _ack(seq, ok=False, status_code=e.status_code, detail=e.detail)
+    except Exception:
+        logger.exception("WebSocket scan failed")
+        return _ack(seq, ok=False, status_code=500, detail="Internal server error")
+    return _ack(seq, ok=True, record=events.record_payload(record))
+
+
+@router.websocket("/scan")
+async def scan_socket(
+    websocket: WebSocket,
+    session_id: int = Query(...),
+    token: str = Query(None)
+):
+    """
+    Persistent scanner channel for one session, authenticated once.
+
+    Client frames: {"type": "scan", "seq": n, "sap_article": ..., ...} with
+    the fields of POST /scan/records (session_id defaults to the one of the
+    connection). Each frame is answered in order with
+    {"type": "ack", "seq": n, "ok": true, "record": {...}} or
+    {"type": "ack", "seq": n, "ok": false, "status_code": ..., "detail": ...}.
+    The session's events are pushed as they happen, with the same payloads
+    as /events/stream.
+    """
+    user = await _authenticate(websocket, token, session_id)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscriber = await sse_manager.connect(session_id)
+    send_lock = asyncio.Lock()
+
+    async def send(text: str):
+        async with send_lock:
+            await websocket.send_text(text)
+
+    async def push_events():
+        try:
+            while True:
+                event = await subscriber.get()
+                if event is None:
+                    # Evicted as a slow consumer or dead, the client reconnects
+                    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                    return
+                await send(event.data.decode())
+        except Exception as e:
+            # Connection gone, the receive loop ends too
+            logger.debug("Scanner WebSocket push stopped: %s", e)
+
+    pusher = asyncio.create_task(push_events())
+    logger.info("Scanner WebSocket connected: user %s, session %s", user.username, session_id)
+    try:
+        while True:
+            frame = await websocket.receive_text()
+            await send(await _handle_frame(frame, user, session_id))
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        logger.info("Scanner WebSocket disconnected: session %s", session_id)
+        pusher.cancel()
+        sse_manager.disconnect(subscriber)
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 from typing import Optional, List
+from uuid import UUID
 from .models import CategoryEnum, ModeEnum, StatusEnum
 
 
@@ -112,6 +113,7 @@ class ScanSession(BaseModel):
     started_at: datetime
     ended_at: Optional[datetime]
     is_active: bool
+    totals_version: int = 0
     
     class Config:
         from_attributes = True
@@ -125,6 +127,11 @@ class ScanRecordCreate(BaseModel):
     quantity: float = 1.0
     manual_entry: bool = False
     detected_category: Optional[CategoryEnum] = None  # Para entrada manual
+    client_scan_id: Optional[UUID] = None  # Reintentos del cliente devuelven el registro original
+
+
+class ScanRecordBatchCreate(BaseModel):
+    records: List[ScanRecordCreate] = Field(..., min_length=1, max_length=500)
 
 class ScanRecord(BaseModel):
     id: int
@@ -139,6 +146,7 @@ class ScanRecord(BaseModel):
     expected_quantity: Optional[float]
     status: Optional[StatusEnum]
     detected_category: Optional[CategoryEnum]  # Agregar esta línea
+    client_scan_id: Optional[str] = None
     class Config:
         from_attributes = True
 
@@ -1,77 +1,505 @@
 import asyncio
-import json
-from typing import AsyncGenerator
+import enum
+import logging
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, FrozenSet, Iterable, Optional
 from sse_starlette.sse import EventSourceResponse
+from . import models, events
+from .events import SSEEvent, PING
+from .broker import Broker, InProcessBroker, create_broker
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class OverflowPolicy(str, enum.Enum):
+    DROP_OLDEST = "drop_oldest"  # discard the oldest queued event
+    RESYNC = "resync"  # replace the backlog with a single resync event
+    DISCONNECT = "disconnect"  # close the connection, the client reconnects
+
+
+# Always delivered, whatever the subscription filter
+CONTROL_EVENTS = {"resync", "ping"}
+
+
+def _criteria(values: Optional[Iterable]) -> Optional[frozenset]:
+    return frozenset(values) if values else None
+
+
+class EventFilter:
+    """
+    Subscription filter of a connection, evaluated before an event is
+    queued. Each criterion is a set of accepted values, None accepts all.
+    Events that aren't about records (categories None) pass the category
+    criterion. fields keeps only those keys of the records sent.
+    Criteria are frozensets so equal projections share one encoding.
+    """
+
+    def __init__(self, categories: Optional[Iterable[str]] = None, modes: Optional[Iterable[str]] = None,
+                 user_ids: Optional[Iterable[int]] = None, session_ids: Optional[Iterable[int]] = None,
+                 event_types: Optional[Iterable[str]] = None, fields: Optional[Iterable[str]] = None):
+        self.categories = _criteria(categories)
+        self.modes = _criteria(modes)
+        self.user_ids = _criteria(user_ids)
+        self.session_ids = _criteria(session_ids)
+        self.event_types = _criteria(event_types)
+        self.fields: Optional[FrozenSet[str]] = _criteria(fields)
+
+    def matches(self, event: SSEEvent) -> bool:
+        if event.event in CONTROL_EVENTS:
+            return True
+        if self.event_types is not None and event.event not in self.event_types:
+            return False
+        if self.session_ids is not None and event.session_id not in self.session_ids:
+            return False
+        if self.user_ids is not None and event.user_id not in self.user_ids:
+            return False
+        if self.modes is not None and event.mode not in self.modes:
+            return False
+        if self.categories is not None and event.categories is not None:
+            return not self.categories.isdisjoint(event.categories)
+        return True
+
+    def apply(self, event: SSEEvent) -> Optional[SSEEvent]:
+        """The event as this subscriber gets it, None if filtered out"""
+        if not self.matches(event):
+            return None
+        # A scan_batch can mix categories, keep only the accepted records
+        narrow = (
+            self.categories is not None and event.categories is not None
+            and "records" in event.payload and not event.categories <= self.categories
+        )
+        if narrow or self.fields is not None:
+            return event.project(self.categories if narrow else None, self.fields)
+        return event
+
+    def describe(self) -> dict:
+        return {
+            name: sorted(values, key=str)
+            for name, values in vars(self).items()
+            if values is not None
+        }
+
+
+class Subscriber:
+    """
+    One SSE connection: a bounded queue of (event, enqueued_at) plus lag
+    counters. A full queue never blocks the publisher, the overflow policy
+    decides what is given up.
+    """
+
+    def __init__(self, topic: str, max_size: int, policy: OverflowPolicy,
+                 event_filter: Optional[EventFilter] = None):
+        self.topic = topic
+        self.policy = policy
+        self.filter = event_filter
+        self.queue: asyncio.Queue = asyncio.Queue(max_size)
+        self.connected_at = time.monotonic()
+        self.delivered = 0
+        self.filtered = 0  # events skipped by the subscription filter
+        self.dropped = 0
+        self.resyncs = 0
+        self.max_depth = 0
+        self.lag = 0.0  # seconds the last delivered event spent queued
+        self.last_activity = self.connected_at  # last event handed to the stream
+        self.pinged_at: Optional[float] = None  # last heartbeat queued, cleared when sent
+        self.closed = False
+
+    def _clear(self) -> int:
+        cleared = 0
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            cleared += 1
+        return cleared
+
+    def offer(self, event: SSEEvent) -> bool:
+        """Queue an event without blocking. Returns False once the subscriber
+        has been closed and must be removed."""
+        if self.closed:
+            return False
+        
+        if self.filter is not None:
+            event = self.filter.apply(event)
+            if event is None:
+                self.filtered += 1
+                return True
+        
+        item = (event, time.monotonic())
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy == OverflowPolicy.DROP_OLDEST:
+                self.queue.get_nowait()
+                self.dropped += 1
+                self.queue.put_nowait(item)
+            elif self.policy == OverflowPolicy.RESYNC:
+                self.dropped += self._clear() + 1
+                self.resyncs += 1
+                self.queue.put_nowait((events.resync("overflow"), time.monotonic()))
+            else:
+                self.dropped += 1
+                self.close()
+                return False
+        
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def close(self):
+        """Drop the backlog and wake the stream so it ends"""
+        if not self.closed:
+            self.closed = True
+            self.dropped += self._clear()
+            self.queue.put_nowait((None, time.monotonic()))
+
+    async def get(self) -> Optional[SSEEvent]:
+        """Next event, None once closed. Heartbeats are queued by the manager."""
+        event, enqueued_at = await self.queue.get()
+        if event is not None:
+            self.last_activity = time.monotonic()
+            if event is PING:
+                self.pinged_at = None
+            else:
+                self.delivered += 1
+                self.lag = self.last_activity - enqueued_at
+        return event
+
+    def stats(self) -> dict:
+        return {
+            "topic": self.topic,
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "delivered": self.delivered,
+            "filtered": self.filtered,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+            "lag_seconds": round(self.lag, 3),
+            "idle_seconds": round(time.monotonic() - self.last_activity, 1),
+            "connected_seconds": round(time.monotonic() - self.connected_at, 1),
+            "filter": self.filter.describe() if self.filter is not None else None,
+        }
+
+
+# ping interval for EventSourceResponse, which runs its own timer per
+# connection otherwise (SSEManager sends the keep-alives)
+SSE_PING_DISABLED = 24 * 60 * 60
+
+
+# Versioned events, a coalescing window doesn't have to be flushed before them
+UNORDERED_EVENTS = {"aggregate"}
+
+
+# Topic of the web panel (session_id=0), receives every event
+FIREHOSE = "firehose"
+
+
+def session_topic(session_id: int) -> str:
+    """Topic a client subscribes to for one session, session_id=0 is the firehose"""
+    return FIREHOSE if session_id == 0 else f"session:{session_id}"
+
+
+class TopicHistory:
+    """Ring buffer of the last events of a topic, for Last-Event-ID replay"""
+
+    def __init__(self, max_size: int):
+        self.events: deque[SSEEvent] = deque(maxlen=max_size)
+        self.trimmed_seq = 0  # newest seq that fell out of the buffer
+
+    def append(self, event: SSEEvent):
+        if len(self.events) == self.events.maxlen:
+            self.trimmed_seq = self.events[0].seq
+        self.events.append(event)
+
+    @property
+    def last_seq(self) -> int:
+        return self.events[-1].seq if self.events else self.trimmed_seq
 
 
 class SSEManager:
-    def __init__(self):
-        self.connections: dict[int, list[asyncio.Queue]] = {}
-    
-    async def connect(self, session_id: int) -> asyncio.Queue:
-        """Create a new SSE connection for a session"""
-        queue = asyncio.Queue()
-        if session_id not in self.connections:
-            self.connections[session_id] = []
-        self.connections[session_id].append(queue)
-        print(f"✅ SSE: Client connected to session {session_id}. Total connections: {sum(len(v) for v in self.connections.values())}")
-        print(f"   Connections by session: {[(k, len(v)) for k, v in self.connections.items()]}")
-        return queue
-    
-    def disconnect(self, session_id: int, queue: asyncio.Queue):
+    """
+    Topic based pub/sub for SSE clients. Every event belongs to one session
+    and is published once: it reaches the subscribers of that session's
+    topic and the firehose, each exactly once, in O(subscribers).
+
+    Events get monotonically increasing IDs "<epoch>-<seq>". The epoch is
+    random per process, so an ID from another instance or before a restart
+    is never mistaken for one of ours and leads to a resync.
+
+    With a coalescing window, the first scan of a session goes out at once
+    and opens the window; scans arriving while it is open are published
+    together as one scan_batch when it closes. Any other event of the
+    session flushes the window first, so ordering is preserved.
+    """
+
+    def __init__(self, queue_size: int, overflow_policy: OverflowPolicy,
+                 replay_size: int, replay_max_topics: int,
+                 coalesce_window: float = 0.0, coalesce_max: int = 50,
+                 heartbeat_interval: float = 15.0,
+                 broker: Optional[Broker] = None):
+        self.topics: dict[str, set[Subscriber]] = {}
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.evicted = 0
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.history: OrderedDict[str, TopicHistory] = OrderedDict()
+        self.replay_size = replay_size
+        self.replay_max_topics = replay_max_topics
+        self.forgotten_seq = 0  # newest seq of a topic history dropped by the LRU
+        self.coalesce_window = coalesce_window
+        self.coalesce_max = coalesce_max
+        self.coalesced = 0  # scans that went out inside a scan_batch
+        self.windows: dict[int, list[SSEEvent]] = {}  # session_id -> scans held back
+        self._window_tasks: dict[int, asyncio.Task] = {}
+        self.heartbeat_interval = heartbeat_interval
+        self.dead = 0  # connections closed because a heartbeat was never sent
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.broker = broker or InProcessBroker()
+        self.broker.deliver = self.dispatch
+        self.broker.on_gap = self.resync_all
+    
+    async def start(self):
+        """Connect the broker and start the heartbeat (app startup)"""
+        await self.broker.start()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+    
+    async def stop(self):
+        """Close every stream and disconnect the broker (app shutdown)"""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        for task in list(self._window_tasks.values()):
+            task.cancel()
+        for session_id in list(self.windows):
+            await self._flush(session_id)
+        self.windows.clear()
+        self._window_tasks.clear()
+        for subscribers in list(self.topics.values()):
+            for subscriber in list(subscribers):
+                self.disconnect(subscriber)
+        await self.broker.stop()
+    
+    def subscribe(self, topic: str, event_filter: Optional[EventFilter] = None) -> Subscriber:
+        subscriber = Subscriber(topic, self.queue_size, self.overflow_policy, event_filter)
+        self.topics.setdefault(topic, set()).add(subscriber)
+        logger.info(
+            "SSE client subscribed to %s, total connections: %d",
+            topic, sum(len(v) for v in self.topics.values())
+        )
+        return subscriber
+    
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.topics.get(subscriber.topic)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.topics[subscriber.topic]
+    
+    def _missed(self, topic: str, last_event_id: str) -> Optional[list[SSEEvent]]:
+        """Events of a topic after last_event_id, None if they can't be replayed"""
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        
+        history = self.history.get(topic)
+        if history is None:
+            return None if seq < self.forgotten_seq else []
+        if seq < history.trimmed_seq:
+            return None
+        return [event for event in history.events if event.seq > seq]
+    
+    async def connect(self, session_id: int, last_event_id: Optional[str] = None,
+                      event_filter: Optional[EventFilter] = None) -> Subscriber:
+        """
+        Create a new SSE connection for a session (0 = all sessions). With
+        last_event_id, the events missed since then are queued first, or a
+        resync event if the gap is no longer in the replay buffer.
+        """
+        topic = session_topic(session_id)
+        subscriber = self.subscribe(topic, event_filter)
+        if last_event_id:
+            missed = self._missed(topic, last_event_id)
+            if missed is None or len(missed) > self.queue_size > 0:
+                logger.info("SSE replay for %s from %s not possible, sending resync", topic, last_event_id)
+                subscriber.offer(events.resync("gap").stamp(f"{self.epoch}-{self.seq}", self.seq))
+            else:
+                for event in missed:
+                    subscriber.offer(event)
+        return subscriber
+    
+    def disconnect(self, subscriber: Subscriber):
         """Remove an SSE connection"""
-        if session_id in self.connections:
-            if queue in self.connections[session_id]:
-                self.connections[session_id].remove(queue)
-            if not self.connections[session_id]:
-                del self.connections[session_id]
-    
-    async def broadcast(self, session_id: int, data: dict):
-        """Broadcast data to all connections for a session"""
-        if session_id in self.connections:
-            dead_queues = []
-            for queue in self.connections[session_id]:
-                try:
-                    await queue.put(data)
-                except:
-                    dead_queues.append(queue)
-            
-            # Clean up dead queues
-            for queue in dead_queues:
-                self.disconnect(session_id, queue)
-    
-    async def broadcast_all(self, data: dict):
-        """Broadcast to all sessions"""
-        print(f"📡 SSE: Broadcasting to all sessions. Event: {data.get('event', 'unknown')}")
-        print(f"   Active sessions: {list(self.connections.keys())}")
-        print(f"   Total clients: {sum(len(v) for v in self.connections.values())}")
+        subscriber.close()
+        self.unsubscribe(subscriber)
+    
+    async def publish(self, session: models.ScanSession, event: SSEEvent):
+        """Publish an event of a session once, the broker delivers it to the
+        subscribers of every worker/instance"""
+        session_id = session.id
+        event.scope(session_id, session.user_id, session.mode.value if session.mode else None)
+        if self.coalesce_window > 0:
+            if event.event == "scan":
+                pending = self.windows.get(session_id)
+                if pending is not None:
+                    pending.append(event)
+                    if len(pending) >= self.coalesce_max:
+                        await self._flush(session_id)
+                    return
+                # Low rate: send right away and hold back the ones that follow
+                self.windows[session_id] = []
+                self._window_tasks[session_id] = asyncio.create_task(self._coalesce(session_id))
+            elif event.event not in UNORDERED_EVENTS and self.windows.get(session_id):
+                await self._flush(session_id)
+        
+        await self.broker.publish(session_id, event)
+    
+    async def _flush(self, session_id: int) -> bool:
+        """Publish the scans held back for a session. False if there were none."""
+        pending = self.windows.get(session_id)
+        if not pending:
+            return False
+        self.windows[session_id] = []
+        if len(pending) == 1:
+            event = pending[0]
+        else:
+            first = pending[0]
+            event = events.coalesce_scans(session_id, pending).scope(session_id, first.user_id, first.mode)
+            self.coalesced += len(pending)
+        await self.broker.publish(session_id, event)
+        return True
+    
+    async def _coalesce(self, session_id: int):
+        """Window of a session, stays open while scans keep arriving"""
+        try:
+            while True:
+                await asyncio.sleep(self.coalesce_window)
+                if not await self._flush(session_id):
+                    return
+        finally:
+            # Nothing can be appended between the empty check and here
+            self.windows.pop(session_id, None)
+            self._window_tasks.pop(session_id, None)
+    
+    def dispatch(self, session_id: int, event: SSEEvent):
+        """Deliver an event to this process' subscribers of its session and
+        the firehose (the same pre-encoded object goes on every queue)"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "SSE dispatch %s to session %s (%d clients)",
+                event.event, session_id, sum(len(v) for v in self.topics.values())
+            )
+        
+        self.seq += 1
+        event.stamp(f"{self.epoch}-{self.seq}", self.seq)
+        
+        evicted = []
+        for topic in {session_topic(session_id), FIREHOSE}:
+            self._remember(topic, event)
+            for subscriber in self.topics.get(topic, ()):
+                if not subscriber.offer(event):
+                    evicted.append(subscriber)
+        
+        for subscriber in evicted:
+            logger.warning("SSE slow consumer on %s disconnected: %s", subscriber.topic, subscriber.stats())
+            self.evicted += 1
+            self.unsubscribe(subscriber)
+    
+    def resync_all(self, reason: str):
+        """Events may have been lost for every client (broker reconnect)"""
+        event = events.resync(reason).stamp(f"{self.epoch}-{self.seq}", self.seq)
+        for subscribers in list(self.topics.values()):
+            for subscriber in list(subscribers):
+                if not subscriber.offer(event):
+                    self.unsubscribe(subscriber)
+    
+    async def _heartbeat(self):
+        """
+        One timer for every connection: each interval, idle subscribers get
+        the shared PING frame. Nothing read since the ping by the next tick
+        means the stream stopped writing (peer gone without a FIN, full
+        socket buffer), the subscriber is closed and dropped from the
+        fan-out. Reads count rather than the ping itself, overflow may have
+        discarded it.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                self.beat(time.monotonic())
+            except Exception:
+                logger.exception("SSE heartbeat failed")
+    
+    def beat(self, now: float):
+        dead = []
+        idle_since = now - self.heartbeat_interval
+        for subscribers in self.topics.values():
+            for subscriber in subscribers:
+                if subscriber.pinged_at is not None and subscriber.last_activity < subscriber.pinged_at:
+                    if subscriber.pinged_at <= idle_since:
+                        dead.append(subscriber)
+                elif subscriber.last_activity <= idle_since:
+                    subscriber.pinged_at = now
+                    if not subscriber.offer(PING):
+                        dead.append(subscriber)
         
-        if not self.connections:
-            print("⚠️  WARNING: No SSE clients connected!")
-            return
-            
-        for session_id in list(self.connections.keys()):
-            await self.broadcast(session_id, data)
-            print(f"   ✓ Broadcasted to session {session_id}")
+        for subscriber in dead:
+            logger.info("SSE connection on %s stopped reading, closing it: %s", subscriber.topic, subscriber.stats())
+            self.dead += 1
+            self.disconnect(subscriber)
+    
+    def _remember(self, topic: str, event: SSEEvent):
+        history = self.history.get(topic)
+        if history is None:
+            history = self.history[topic] = TopicHistory(self.replay_size)
+            if len(self.history) > self.replay_max_topics:
+                _, forgotten = self.history.popitem(last=False)
+                self.forgotten_seq = max(self.forgotten_seq, forgotten.last_seq)
+        else:
+            self.history.move_to_end(topic)
+        history.append(event)
+    
+    def stats(self) -> dict:
+        """Per-connection queue depth and lag, for spotting slow consumers"""
+        subscribers = [subscriber.stats() for topic in self.topics.values() for subscriber in topic]
+        return {
+            "connections": len(subscribers),
+            "queue_size": self.queue_size,
+            "overflow_policy": self.overflow_policy.value,
+            "evicted": self.evicted,
+            "last_event_id": f"{self.epoch}-{self.seq}",
+            "coalesced": self.coalesced,
+            "dead": self.dead,
+            "dropped": sum(subscriber["dropped"] for subscriber in subscribers),
+            "subscribers": subscribers,
+        }
 
 
 # Global SSE manager instance
-sse_manager = SSEManager()
+sse_manager = SSEManager(
+    settings.SSE_QUEUE_SIZE,
+    OverflowPolicy(settings.SSE_OVERFLOW_POLICY),
+    settings.SSE_REPLAY_SIZE,
+    settings.SSE_REPLAY_MAX_TOPICS,
+    settings.SSE_COALESCE_MS / 1000,
+    settings.SSE_COALESCE_MAX,
+    settings.SSE_HEARTBEAT_SECONDS,
+    create_broker()
+)
 
 
-async def event_generator(queue: asyncio.Queue) -> AsyncGenerator[dict, None]:
-    """Generate SSE events from queue"""
+async def event_generator(subscriber: Subscriber) -> AsyncGenerator[bytes, None]:
+    """Generate pre-framed SSE events for a subscriber until it is closed"""
     try:
         while True:
-            # Send heartbeat every 15 seconds to keep connection alive
-            try:
-                data = await asyncio.wait_for(queue.get(), timeout=15.0)
-                yield data
-            except asyncio.TimeoutError:
-                # Send ping to keep connection alive
-                yield {
-                    "event": "ping",
-                    "data": json.dumps({"type": "ping"})
-                }
+            # Keep-alive pings come through the queue (SSEManager heartbeat)
+            event = await subscriber.get()
+            if event is None:
+                # Evicted (slow consumer, dead connection), end the stream so the client reconnects
+                return
+            yield event.frame
     except asyncio.CancelledError:
         pass
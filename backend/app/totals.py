@@ -0,0 +1,374 @@
+from datetime import datetime
+from typing import Iterable, Optional
+from sqlalchemy import and_, case, delete, func, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models
+
+Totals = models.SessionArticleTotal
+
+# Per-status scan counter of a totals row
+STATUS_SCANS = {
+    models.StatusEnum.MATCH: "match_scans",
+    models.StatusEnum.OVER: "over_scans",
+    models.StatusEnum.UNDER: "under_scans",
+    models.StatusEnum.PENDING: "pending_scans",
+}
+
+
+def comparison_status(total_scanned: float, expected_quantity: float) -> models.StatusEnum:
+    """Compare the scanned total of an article against its BOM quantity"""
+    if total_scanned == expected_quantity:
+        return models.StatusEnum.MATCH
+    elif total_scanned > expected_quantity:
+        return models.StatusEnum.OVER
+    return models.StatusEnum.UNDER
+
+
+def _category_filter(column, detected_category: Optional[models.CategoryEnum]):
+    if detected_category is None:
+        return column.is_(None)
+    return column == detected_category
+
+
+def _totals_key(session_id: int, sap_article: str, detected_category: Optional[models.CategoryEnum]):
+    return and_(
+        Totals.session_id == session_id,
+        Totals.sap_article == sap_article,
+        _category_filter(Totals.detected_category, detected_category)
+    )
+
+
+def _records_key(session_id: int, sap_article: str, detected_category: Optional[models.CategoryEnum]):
+    return and_(
+        models.ScanRecord.session_id == session_id,
+        models.ScanRecord.sap_article == sap_article,
+        _category_filter(models.ScanRecord.detected_category, detected_category)
+    )
+
+
+def _scans_by_status(statuses: Iterable[Optional[models.StatusEnum]], sign: int = 1) -> dict[str, int]:
+    """Changes of the per-status scan counters for records with these statuses"""
+    counts: dict[str, int] = {}
+    for status in statuses:
+        if status is not None:
+            column = STATUS_SCANS[status]
+            counts[column] = counts.get(column, 0) + sign
+    return counts
+
+
+def _increment(counts: dict[str, int]) -> dict:
+    """UPDATE values adding counts to the scan counters"""
+    return {column: getattr(Totals, column) + count for column, count in counts.items() if count}
+
+
+def _status(status: models.StatusEnum):
+    return literal(status, Totals.__table__.c.status.type)
+
+
+def _status_after(new_total):
+    """SQL expression for a row's status once its total becomes new_total.
+    Rows without expected quantity keep their status (OVER for articles
+    outside the BOM, NULL in INVENTORY sessions)."""
+    return case(
+        (Totals.expected_qty.is_(None), Totals.status),
+        (new_total == Totals.expected_qty, _status(models.StatusEnum.MATCH)),
+        (new_total > Totals.expected_qty, _status(models.StatusEnum.OVER)),
+        else_=_status(models.StatusEnum.UNDER)
+    )
+
+
+async def _bump_version(db: AsyncSession, session_id: int):
+    # First write of the transaction to the session's totals: on PostgreSQL the
+    # row lock also orders concurrent writers, so versions match their commits
+    await db.execute(update(models.ScanSession).where(
+        models.ScanSession.id == session_id
+    ).values(
+        totals_version=models.ScanSession.totals_version + 1
+    ).execution_options(synchronize_session=False))
+
+
+def changed_articles(records: Iterable[models.ScanRecord]) -> dict[int, set[tuple]]:
+    """(sap_article, detected_category) keys touched by records, per session"""
+    changed: dict[int, set[tuple]] = {}
+    for record in records:
+        changed.setdefault(record.session_id, set()).add((record.sap_article, record.detected_category))
+    return changed
+
+
+async def _scanned_total(db: AsyncSession, session_id: int, sap_article: str) -> float:
+    """Scanned quantity of an article in a session, over every category"""
+    total = (await db.execute(select(func.sum(Totals.total_qty)).where(
+        Totals.session_id == session_id,
+        Totals.sap_article == sap_article
+    ))).scalar()
+    return float(total or 0.0)
+
+
+async def _compare_with_bom(db: AsyncSession, records: list[models.ScanRecord]):
+    """Set the status of new records with a BOM quantity from the article's
+    scanned total. Records of one article in the batch count in order."""
+    compared = [record for record in records if record.expected_quantity is not None]
+    if not compared:
+        return
+
+    keys = {(record.session_id, record.sap_article) for record in compared}
+    rows = await db.execute(select(
+        Totals.session_id,
+        Totals.sap_article,
+        func.sum(Totals.total_qty)
+    ).where(
+        or_(*(and_(Totals.session_id == session_id, Totals.sap_article == sap_article)
+              for session_id, sap_article in keys))
+    ).group_by(Totals.session_id, Totals.sap_article))
+    running = {(session_id, sap_article): float(total) for session_id, sap_article, total in rows}
+
+    for record in compared:
+        key = (record.session_id, record.sap_article)
+        running[key] = running.get(key, 0.0) + record.quantity
+        record.status = comparison_status(running[key], record.expected_quantity)
+
+
+async def add_records(db: AsyncSession, records: Iterable[models.ScanRecord]):
+    """
+    Fold new scan records into their totals rows. Runs in the caller's
+    transaction; counters are incremented in SQL so concurrent writers
+    don't lose updates. The status of records with a BOM quantity is set
+    here, from the totals as of this transaction.
+    """
+    records = list(records)
+    with db.no_autoflush:
+        for session_id in sorted({record.session_id for record in records}):
+            await _bump_version(db, session_id)
+        # Read after the version bump, which serializes the session's writers
+        await _compare_with_bom(db, records)
+
+    # Insert the records, a duplicate client_scan_id fails here
+    await db.flush()
+
+    groups: dict[tuple, list[models.ScanRecord]] = {}
+    for record in records:
+        if record.scanned_at is None:
+            record.scanned_at = datetime.utcnow()
+        key = (record.session_id, record.sap_article, record.detected_category)
+        groups.setdefault(key, []).append(record)
+
+    for (session_id, sap_article, detected_category), group in groups.items():
+        quantity = sum(record.quantity for record in group)
+        status_scans = _scans_by_status(record.status for record in group)
+        first_scan = min(record.scanned_at for record in group)
+        last_scan = max(record.scanned_at for record in group)
+        new_total = Totals.total_qty + quantity
+        increment = update(Totals).where(
+            _totals_key(session_id, sap_article, detected_category)
+        ).values(
+            total_qty=new_total,
+            scan_count=Totals.scan_count + len(group),
+            **_increment(status_scans),
+            first_scan=case((Totals.first_scan > first_scan, first_scan), else_=Totals.first_scan),
+            last_scan=case((Totals.last_scan < last_scan, last_scan), else_=Totals.last_scan),
+            status=_status_after(new_total)
+        ).execution_options(synchronize_session=False)
+
+        result = await db.execute(increment)
+        if result.rowcount:
+            continue
+
+        record = group[0]
+        expected_qty = record.expected_quantity
+        try:
+            async with db.begin_nested():
+                db.add(Totals(
+                    session_id=session_id,
+                    sap_article=sap_article,
+                    detected_category=detected_category,
+                    part_number=record.part_number,
+                    description=record.description,
+                    total_qty=quantity,
+                    scan_count=len(group),
+                    **status_scans,
+                    first_scan=first_scan,
+                    last_scan=last_scan,
+                    expected_qty=expected_qty,
+                    status=comparison_status(quantity, expected_qty) if expected_qty is not None else record.status
+                ))
+        except IntegrityError:
+            # First scan of the article committed concurrently, add to that row
+            await db.execute(increment)
+
+
+async def update_record(
+    db: AsyncSession,
+    record: models.ScanRecord,
+    quantity_delta: float,
+    expected_qty: Optional[float] = None
+):
+    """Apply a quantity edit of one record to its totals row. With the
+    article's BOM quantity the record's status is compared again, against
+    the article's total after the edit."""
+    previous_status = record.status
+    key = _totals_key(record.session_id, record.sap_article, record.detected_category)
+    await _bump_version(db, record.session_id)
+    new_total = Totals.total_qty + quantity_delta
+    await db.execute(update(Totals).where(key).values(
+        total_qty=new_total,
+        status=_status_after(new_total)
+    ).execution_options(synchronize_session=False))
+
+    if expected_qty is not None:
+        scanned = await _scanned_total(db, record.session_id, record.sap_article)
+        record.status = comparison_status(scanned, expected_qty)
+    if record.status != previous_status:
+        status_scans = _scans_by_status([previous_status], -1)
+        for column, count in _scans_by_status([record.status]).items():
+            status_scans[column] = status_scans.get(column, 0) + count
+        await db.execute(update(Totals).where(key).values(
+            **_increment(status_scans)
+        ).execution_options(synchronize_session=False))
+
+
+async def remove_record(db: AsyncSession, record: models.ScanRecord):
+    """Take a deleted record out of its totals row. Call after the delete is
+    flushed, first/last scan are recomputed from the remaining records."""
+    await _bump_version(db, record.session_id)
+    key = (record.session_id, record.sap_article, record.detected_category)
+    new_total = Totals.total_qty - record.quantity
+    remaining = select(models.ScanRecord.scanned_at).where(_records_key(*key))
+
+    await db.execute(update(Totals).where(_totals_key(*key)).values(
+        total_qty=new_total,
+        scan_count=Totals.scan_count - 1,
+        **_increment(_scans_by_status([record.status], -1)),
+        first_scan=select(func.min(remaining.c.scanned_at)).scalar_subquery(),
+        last_scan=select(func.max(remaining.c.scanned_at)).scalar_subquery(),
+        status=_status_after(new_total)
+    ).execution_options(synchronize_session=False))
+    await db.execute(delete(Totals).where(
+        _totals_key(*key),
+        Totals.scan_count <= 0
+    ).execution_options(synchronize_session=False))
+
+
+def _article_total(row: Totals) -> dict:
+    return {
+        "sap_article": row.sap_article,
+        "detected_category": row.detected_category.value if row.detected_category else None,
+        "total_quantity": float(row.total_qty),
+        "scan_count": row.scan_count,
+        "expected_quantity": row.expected_qty,
+        "status": row.status.value if row.status else None
+    }
+
+
+async def session_aggregate(db: AsyncSession, session_id: int, articles: Iterable[tuple] = ()) -> dict:
+    """
+    Version and live counters of a session: scanned/match/over/under scans, per
+    category totals and, for the given (sap_article, detected_category)
+    keys, their current totals (removed when the last scan was deleted).
+    Called in the writing transaction it describes exactly that version.
+    Values are absolute, so applying a delta twice is harmless.
+    """
+    # Version first: a snapshot read outside a write may include newer
+    # changes than its version, never older ones
+    version = (await db.execute(select(models.ScanSession.totals_version).where(
+        models.ScanSession.id == session_id
+    ))).scalar_one()
+
+    rows = (await db.execute(select(
+        Totals.detected_category,
+        func.count(Totals.id),
+        func.sum(Totals.scan_count),
+        func.sum(Totals.total_qty),
+        *(func.sum(getattr(Totals, column)) for column in STATUS_SCANS.values())
+    ).where(
+        Totals.session_id == session_id
+    ).group_by(Totals.detected_category))).all()
+
+    counts = {"articles": 0, "scanned": 0, "quantity": 0.0, "match": 0, "over": 0, "under": 0, "pending": 0}
+    categories: dict[str, dict] = {}
+    for detected_category, article_count, scan_count, quantity, *status_scans in rows:
+        counts["articles"] += article_count
+        counts["scanned"] += scan_count
+        counts["quantity"] += float(quantity)
+        for status, scans in zip(STATUS_SCANS, status_scans):
+            counts[status.value.lower()] += scans
+        category = categories.setdefault(
+            detected_category.value if detected_category else "UNKNOWN",
+            {"articles": 0, "scanned": 0, "quantity": 0.0}
+        )
+        category["articles"] += article_count
+        category["scanned"] += scan_count
+        category["quantity"] += float(quantity)
+
+    aggregate = {
+        "session_id": session_id,
+        "version": version,
+        "counts": counts,
+        "categories": categories
+    }
+
+    keys = list(articles)
+    if keys:
+        current = (await db.execute(select(Totals).where(
+            or_(*(_totals_key(session_id, *key) for key in keys))
+        ).execution_options(populate_existing=True))).scalars().all()
+        changed = {(row.sap_article, row.detected_category): _article_total(row) for row in current}
+        aggregate["articles"] = [
+            changed.get(key) or {
+                "sap_article": key[0],
+                "detected_category": key[1].value if key[1] else None,
+                "removed": True
+            }
+            for key in keys
+        ]
+    return aggregate
+
+
+def rebuild(db: Session):
+    """Recompute every totals row from scan_records (backfill of existing data)"""
+    rows = db.query(
+        models.ScanRecord.session_id,
+        models.ScanRecord.sap_article,
+        models.ScanRecord.detected_category,
+        func.max(models.ScanRecord.part_number),
+        func.max(models.ScanRecord.description),
+        func.sum(models.ScanRecord.quantity),
+        func.count(models.ScanRecord.id),
+        *(func.sum(case((models.ScanRecord.status == status, 1), else_=0)) for status in STATUS_SCANS),
+        func.min(models.ScanRecord.scanned_at),
+        func.max(models.ScanRecord.scanned_at),
+        func.max(models.ScanRecord.expected_quantity),
+        models.ScanSession.mode
+    ).join(models.ScanSession).group_by(
+        models.ScanRecord.session_id,
+        models.ScanRecord.sap_article,
+        models.ScanRecord.detected_category,
+        models.ScanSession.mode
+    ).all()
+
+    db.query(Totals).delete()
+    for (session_id, sap_article, detected_category, part_number, description,
+         total_qty, scan_count, *status_scans, first_scan, last_scan, expected_qty, mode) in rows:
+        if expected_qty is not None:
+            status = comparison_status(total_qty, expected_qty)
+        elif mode == models.ModeEnum.BOM:
+            status = models.StatusEnum.OVER
+        else:
+            status = None
+        db.add(Totals(
+            session_id=session_id,
+            sap_article=sap_article,
+            detected_category=detected_category,
+            part_number=part_number,
+            description=description,
+            total_qty=total_qty,
+            scan_count=scan_count,
+            **dict(zip(STATUS_SCANS.values(), status_scans)),
+            first_scan=first_scan,
+            last_scan=last_scan,
+            expected_qty=expected_qty,
+            status=status
+        ))
+    db.commit()
+    return len(rows)
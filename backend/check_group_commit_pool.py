@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Group commit pool check: scans waiting for the group commit writer must
+not hold pooled database connections.
+
+Starts the app on a temporary SQLite database with SCAN_GROUP_COMMIT on and
+the async engine swapped for a bounded AsyncAdaptedQueuePool (no overflow,
+short pool_timeout), then posts more concurrent scans than the pool has
+connections. Every scan must succeed in the shared transaction: if the
+requests kept their connections while waiting, the writer would time out
+getting one and fall back to committing each record on its own.
+
+    python check_group_commit_pool.py
+    python check_group_commit_pool.py --pool-size 5 --scans 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+POOL_TIMEOUT = 2.0  # seconds the writer may wait for a connection
+
+
+async def check(pool_size: int, scans: int, database_path: str) -> bool:
+    import httpx
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+    from app import database
+    from app.group_commit import scan_writer
+    from app.main import app, lifespan
+
+    bounded_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_path}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=POOL_TIMEOUT,
+    )
+    database.AsyncSessionLocal.configure(bind=bounded_engine)
+
+    fallbacks = []
+    commit_each = scan_writer._commit_each
+
+    async def counting_commit_each(batch):
+        fallbacks.append(len(batch))
+        await commit_each(batch)
+
+    scan_writer._commit_each = counting_commit_each
+
+    success = True
+    try:
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://check", timeout=30) as client:
+                response = await client.post("/auth/login", json={"username": "admin", "password": "admin123"})
+                headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+                response = await client.post("/scan/sessions", json={"mode": "INVENTORY"}, headers=headers)
+                session_id = response.json()["id"]
+
+                responses = await asyncio.gather(*[
+                    client.post(
+                        "/scan/records",
+                        json={"session_id": session_id, "sap_article": f"POOL-{i % 3}"},
+                        headers=headers
+                    )
+                    for i in range(scans)
+                ])
+                failed = [response.status_code for response in responses if response.status_code != 200]
+                ok = not failed
+                success &= ok
+                print(f"{'ok  ' if ok else 'FAIL'} {scans} concurrent scans on a pool of {pool_size}: "
+                      f"{scans - len(failed)} stored{f', failed with {failed}' if failed else ''}")
+
+                ok = not fallbacks
+                success &= ok
+                print(f"{'ok  ' if ok else 'FAIL'} shared transactions: "
+                      f"{f'{sum(fallbacks)} records retried one by one' if fallbacks else 'no fallback'}")
+
+                ok = bounded_engine.pool.checkedout() == 0
+                success &= ok
+                print(f"{'ok  ' if ok else 'FAIL'} pool after the scans: {bounded_engine.pool.status()}")
+    finally:
+        await bounded_engine.dispose()
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pool-size", type=int, default=3, help="async pool size (default: 3)")
+    parser.add_argument("--scans", type=int, default=12, help="concurrent scans (default: 12)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, "group_commit_pool.db")
+        # Before importing the app, settings are read at import time
+        os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+        os.environ["SCAN_GROUP_COMMIT"] = "true"
+        os.environ["SCAN_GROUP_COMMIT_WINDOW_MS"] = "50"
+        success = asyncio.run(check(args.pool_size, args.scans, database_path))
+    sys.exit(0 if success else 1)
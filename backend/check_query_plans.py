@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Query plan check: the hot scan/overview queries must be served by an index.
+
+Builds a scratch database, removes the hot path indexes (like a database
+created before they existed), runs the migrations, seeds a dataset and
+checks EXPLAIN (PostgreSQL) / EXPLAIN QUERY PLAN (SQLite) for each query.
+
+    python check_query_plans.py                         # temporary SQLite file
+    python check_query_plans.py --url postgresql://...  # EMPTY scratch PostgreSQL database
+
+Never point --url at a real database, its tables are dropped and seeded.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select, text
+from app.database import Base
+from app import models, migrations
+
+HOT_INDEXES = {
+    models.ScanRecord.__table__: ["ix_scan_records_session_article", "ix_scan_records_session_status"],
+    models.BOMItem.__table__: ["ix_bom_items_bom_article"],
+    models.ScanSession.__table__: ["ix_scan_sessions_user_active_started"],
+}
+
+# (description, statement, index expected in the plan)
+HOT_QUERIES = [
+    (
+        "scanned total of an article in a session",
+        select(func.sum(models.ScanRecord.quantity)).where(
+            models.ScanRecord.session_id == 7,
+            models.ScanRecord.sap_article == "ART-00042"
+        ),
+        "ix_scan_records_session_article",
+    ),
+    (
+        "status count of a session",
+        select(func.count(models.ScanRecord.id)).where(
+            models.ScanRecord.session_id == 7,
+            models.ScanRecord.status == models.StatusEnum.MATCH
+        ),
+        "ix_scan_records_session_status",
+    ),
+    (
+        "expected quantity of an article in a BOM",
+        select(models.BOMItem.quantity).where(
+            models.BOMItem.bom_id == 3,
+            models.BOMItem.sap_article == "ART-00042"
+        ),
+        "ix_bom_items_bom_article",
+    ),
+    (
+        "active sessions of a user, newest first",
+        select(models.ScanSession).where(
+            models.ScanSession.user_id == 1,
+            models.ScanSession.is_active == True
+        ).order_by(models.ScanSession.started_at.desc()),
+        "ix_scan_sessions_user_active_started",
+    ),
+]
+
+
+def seed(conn, users=5, sessions=200, boms=20, bom_items=300, records=50000):
+    random.seed(0)
+    now = datetime.utcnow()
+    conn.execute(models.User.__table__.insert(), [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@demo.com", "hashed_password": "x", "is_active": True}
+        for i in range(1, users + 1)
+    ])
+    conn.execute(models.BOM.__table__.insert(), [
+        {"id": i, "name": f"BOM {i}", "category": models.CategoryEnum.CCTV, "uploaded_by": 1, "uploaded_at": now}
+        for i in range(1, boms + 1)
+    ])
+    conn.execute(models.BOMItem.__table__.insert(), [
+        {"bom_id": b, "sap_article": f"ART-{a:05d}", "part_number": f"P{a}", "description": "d", "quantity": 10}
+        for b in range(1, boms + 1) for a in range(bom_items)
+    ])
+    conn.execute(models.ScanSession.__table__.insert(), [
+        {
+            "id": i,
+            "user_id": random.randint(1, users),
+            "mode": models.ModeEnum.BOM,
+            "category": models.CategoryEnum.CCTV,
+            "bom_id": random.randint(1, boms),
+            "started_at": now - timedelta(hours=i),
+            "is_active": i % 10 == 0,
+        }
+        for i in range(1, sessions + 1)
+    ])
+    statuses = [models.StatusEnum.MATCH, models.StatusEnum.OVER, models.StatusEnum.UNDER]
+    conn.execute(models.ScanRecord.__table__.insert(), [
+        {
+            "session_id": random.randint(1, sessions),
+            "sap_article": f"ART-{random.randrange(bom_items * 2):05d}",
+            "quantity": 1,
+            "scanned_at": now,
+            "status": random.choice(statuses),
+        }
+        for _ in range(records)
+    ])
+
+
+def explain(conn, statement) -> str:
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN QUERY PLAN" if conn.dialect.name == "sqlite" else "EXPLAIN"
+    rows = conn.exec_driver_sql(f"{prefix} {compiled}").all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def check(url: str) -> bool:
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    migrations.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    # Start from a schema without the hot path indexes, the migration must add them
+    with engine.begin() as conn:
+        for table, names in HOT_INDEXES.items():
+            for index in table.indexes:
+                if index.name in names:
+                    index.drop(conn)
+    migrations.upgrade(engine)
+
+    with engine.begin() as conn:
+        seed(conn)
+        conn.execute(text("ANALYZE"))
+
+    ok = True
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # A small dataset can make a seq scan cheaper, only index usability matters here
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for description, statement, index_name in HOT_QUERIES:
+            plan = explain(conn, statement)
+            uses_index = index_name in plan
+            ok = ok and uses_index
+            print(f"{'✅' if uses_index else '❌'} {description}: expected {index_name}")
+            if not uses_index:
+                print("   " + plan.replace("\n", "\n   "))
+
+    engine.dispose()
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="scratch database URL (default: temporary SQLite file)")
+    args = parser.parse_args()
+
+    if args.url:
+        success = check(args.url)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            success = check(f"sqlite:///{os.path.join(tmp, 'plans.db')}")
+    sys.exit(0 if success else 1)
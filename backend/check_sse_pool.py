@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+SSE pool check: open event streams must not hold database connections.
+
+Starts the app on a temporary SQLite database, opens more concurrent
+/events/stream connections than the pool can hand out (pool_size +
+max_overflow), then checks that no pooled connection is checked out and
+that a scan can still be written while every stream is open. Also checks
+that no streaming route depends on a database session: depending on the
+FastAPI version, a yield dependency is closed only when the response ends.
+
+    python check_sse_pool.py
+    python check_sse_pool.py --streams 50
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+from contextlib import AsyncExitStack
+
+WRITE_TIMEOUT = 5.0  # a pinned pool would make the write wait up to pool_timeout (30 s)
+
+
+STREAMING_ROUTES = ["/events/stream"]
+
+
+def _dependency_calls(dependant):
+    for dependency in dependant.dependencies:
+        yield dependency.call
+        yield from _dependency_calls(dependency)
+
+
+def check_routes(app) -> bool:
+    from app.database import get_db, get_async_db
+
+    success = True
+    for route in app.routes:
+        if getattr(route, "path", None) in STREAMING_ROUTES:
+            pinned = [call.__name__ for call in _dependency_calls(route.dependant) if call in (get_db, get_async_db)]
+            ok = not pinned
+            success &= ok
+            print(f"{'ok  ' if ok else 'FAIL'} {route.path} database dependencies: {pinned or 'none'}")
+    return success
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def check(streams: int) -> bool:
+    import httpx
+    import uvicorn
+    from app.main import app
+    from app.database import engine, async_engine
+
+    success = check_routes(app)
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=WRITE_TIMEOUT) as client:
+            response = await client.post("/auth/login", json={"username": "admin", "password": "admin123"})
+            token = response.json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            async with AsyncExitStack() as stack:
+                for _ in range(streams):
+                    # Entering the context waits for the response headers
+                    response = await stack.enter_async_context(
+                        client.stream("GET", "/events/stream", params={"token": token})
+                    )
+                    if response.status_code != 200:
+                        print(f"FAIL stream returned {response.status_code}")
+                        return False
+                print(f"{streams} streams open")
+
+                for name, pool in (("sync", engine.pool), ("async", async_engine.pool)):
+                    if not hasattr(pool, "checkedout"):
+                        # NullPool (aiosqlite): nothing to pin, the write below still covers it
+                        print(f"skip {name} pool: {type(pool).__name__}")
+                        continue
+                    checked_out = pool.checkedout()
+                    ok = checked_out == 0
+                    success &= ok
+                    print(f"{'ok  ' if ok else 'FAIL'} {name} pool: {checked_out} connections checked out ({pool.status()})")
+
+                try:
+                    response = await client.post("/scan/sessions", json={"mode": "INVENTORY"}, headers=headers)
+                    session_id = response.json()["id"]
+                    response = await client.post(
+                        "/scan/records",
+                        json={"session_id": session_id, "sap_article": "POOL-CHECK"},
+                        headers=headers
+                    )
+                    ok = response.status_code == 200
+                except httpx.TimeoutException:
+                    ok = False
+                success &= ok
+                print(f"{'ok  ' if ok else 'FAIL'} scan write with every stream open")
+    finally:
+        server.should_exit = True
+        await serving
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20, help="concurrent streams (default: 20)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before importing the app, settings are read at import time
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'sse_pool.db')}"
+        success = asyncio.run(check(args.streams))
+    sys.exit(0 if success else 1)
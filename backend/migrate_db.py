@@ -1,50 +1,49 @@
 #!/usr/bin/env python3
 """
-Database Migration: Add detected_category column
-Run this once to update the database schema
+Database Migration: apply pending schema migrations (SQLite or PostgreSQL)
+Uses the same database configuration as the app (DATABASE_URL / DB_DIALECT).
+
+    python migrate_db.py           # apply pending migrations
+    python migrate_db.py --status  # list migrations and whether they are applied
 """
-import sqlite3
+import argparse
 import sys
+from sqlalchemy.exc import SQLAlchemyError
+from app.database import engine, Base
+from app import migrations
+from app.logger import setup_logging
 
-DB_PATH = "inventory_scanner.db"
-
-def column_exists(cursor, table, column):
-    """Check if column exists in table"""
-    cursor.execute(f"PRAGMA table_info({table})")
-    columns = [row[1] for row in cursor.fetchall()]
-    return column in columns
 
 def migrate():
-    """Add detected_category column to scan_records"""
-    print(f"🔍 Connecting to {DB_PATH}...")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+    """Create missing tables and apply pending migrations"""
+    print(f"🔍 Connecting to {engine.url.get_backend_name()}...")
+
     try:
-        # Check if column already exists
-        if column_exists(cursor, "scan_records", "detected_category"):
-            print("✓ Column 'detected_category' already exists. Migration not needed.")
-            return True
-        
-        # Add the column
-        print("🔧 Adding column 'detected_category' to scan_records...")
-        cursor.execute("""
-            ALTER TABLE scan_records 
-            ADD COLUMN detected_category VARCHAR(50);
-        """)
-        conn.commit()
-        
-        print("✅ Migration completed successfully!")
-        print("   Column 'detected_category' added to 'scan_records' table")
-        return True
-        
-    except sqlite3.Error as e:
+        Base.metadata.create_all(bind=engine)
+        applied = migrations.upgrade(engine)
+    except SQLAlchemyError as e:
         print(f"❌ Migration failed: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
+
+    if applied:
+        print(f"✅ Applied {len(applied)} migration(s)")
+    else:
+        print("✓ Database is up to date. Migration not needed.")
+    return True
+
+
+def show_status():
+    for migration, applied in migrations.status(engine):
+        mark = "✓" if applied else " "
+        print(f"[{mark}] {migration.version:04d} {migration.name}")
+    return True
+
 
 if __name__ == "__main__":
-    success = migrate()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    args = parser.parse_args()
+    setup_logging()
+
+    success = show_status() if args.status else migrate()
+    sys.exit(0 if success else 1)